@@ -0,0 +1,628 @@
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import closing
+import commands
+import init_db
+import messages
+import main
+import suggestions
+import worlds
+from messages import Message, Pointer
+
+
+def describe(x):
+    """
+    A plain data description of a parse result, for comparing parsers
+    """
+    if isinstance(x, messages.Message):
+        return ("message", x.text, tuple(describe(f) for f in x.fields))
+    if isinstance(x, messages.Pointer):
+        return ("pointer", x.n)
+    if isinstance(x, commands.Command):
+        return (type(x).__name__,
+                tuple((k, describe(getattr(x, k))) for k in x.command_args))
+    if isinstance(x, list):
+        return tuple(describe(y) for y in x)
+    return x
+
+
+def parse_with(parser, rule, s):
+    if parser == "reference":
+        return describe(commands.reference_parse(rule, s))
+    try:
+        return describe(commands.Parser(s).parse_all(rule))
+    except commands.ParseFailure:
+        return describe(commands.Malformed())
+
+
+builtin_corpus = [
+    "ask what cell contains the agent in grid #0?",
+    "ask move the agent north in grid #1",
+    "ask what is in cell #2 in grid #0?",
+    "ask10 is cell #1 east of cell (the cell south of #2)?",
+    "reply the agent is in cell #3",
+    "reply (the resulting grid is #1)",
+    "note the goal is in cell #0 (next to [a wall #1])",
+    "view 3",
+    "clear 2",
+    "replace 1 with the grid after moving #0",
+    "more 2",
+    "resume 1 with the agent can't reach the goal",
+    "raise 0 the grid #1 has no goal",
+    "fix 1",
+    "the resulting grid is #4",
+    "it contains (a block)",
+    "what direction moves the agent closer to the goal in grid #0?",
+    "ask [unbalanced",
+    "reply #",
+]
+
+
+def load_responses():
+    """
+    Every response in memoize.db, or builtin_corpus if there is no database
+    """
+    try:
+        with closing(sqlite3.connect("file:memoize.db?mode=ro",
+                                     uri=True)) as db:
+            return [r for r, in db.execute("SELECT output FROM responses")]
+    except sqlite3.OperationalError:
+        print("no responses in memoize.db, using the builtin corpus")
+        return builtin_corpus
+
+
+def parser_benchmark(corpus=None, rules=("command", "message")):
+    """
+    Check the hand written parser against the pyparsing grammar
+    on every response in memoize.db, and compare their throughput.
+    """
+    if corpus is None:
+        corpus = load_responses()
+    disagreements = []
+    for s in corpus:
+        for rule in rules:
+            if parse_with("fast", rule, s) != parse_with("reference", rule, s):
+                disagreements.append((rule, s))
+    print("{} strings, {} disagreements".format(len(corpus),
+                                                len(disagreements)))
+    for rule, s in disagreements[:10]:
+        print("  {}: {!r}".format(rule, s))
+    for parser in ["fast", "reference"]:
+        start = time.perf_counter()
+        for s in corpus:
+            for rule in rules:
+                parse_with(parser, rule, s)
+        elapsed = time.perf_counter() - start
+        print("{}: {:.0f} parses/second".format(
+            parser, len(corpus) * len(rules) / max(elapsed, 1e-9)))
+    return disagreements
+
+
+def synthetic_corpus(n=2000, seed=0):
+    """
+    Questions made of a few words, some of them sharing only
+    a stem with each other, so that fuzzy matches cross token boundaries
+    """
+    rng = random.Random(seed)
+    stems = ["move", "agent", "north", "goal", "grid", "cell", "wall",
+             "block", "push", "east", "what", "direction", "contain"]
+    endings = ["", "", "", "s", "ing", "ward", "ed"]
+    corpus = set()
+    while len(corpus) < n:
+        words = [rng.choice(stems) + rng.choice(endings)
+                 for _ in range(rng.randint(1, 6))]
+        corpus.add(" ".join(words))
+    return sorted(corpus)
+
+
+def index_benchmark(corpus=None, queries=100, seed=0):
+    """
+    Check that suggestions found through the token index match
+    a full scan of every key, and compare their throughput.
+    """
+    if corpus is None:
+        corpus = synthetic_corpus(5000, seed=seed)
+    rng = random.Random(seed)
+    cases = [("move agent north bar",
+              dict([("moving agents northward", "A")] + [
+                  ("foo bar baz {} qux".format(k), "C{}".format(k))
+                  for k in range(40)]))]
+    d = {k: "response {}".format(i) for i, k in enumerate(corpus)}
+    cases.extend((q, d) for q in rng.sample(corpus, queries // 2))
+    cases.extend((q, d) for q in synthetic_corpus(queries // 2, seed + 1))
+    timings = {"scan": 0, "index": 0}
+    indexes = {}
+    for query, d in cases:
+        if id(d) not in indexes: indexes[id(d)] = suggestions.TokenIndex(d)
+        index = indexes[id(d)]
+        start = time.perf_counter()
+        expected = suggestions.best_dict_values(query, d)
+        scanned = time.perf_counter()
+        found = suggestions.best_dict_values(query, d, index=index)
+        timings["scan"] += scanned - start
+        timings["index"] += time.perf_counter() - scanned
+        assert found == expected, (query, found, expected)
+    for name, elapsed in timings.items():
+        print("{}: {:.0f} queries/second".format(name, len(cases) / elapsed))
+
+
+def scorer_benchmark(corpus=None, queries=100, n=15, seed=0):
+    """
+    Check that every scorer ranks keys as the reference FuzzScorer does,
+    and compare their throughput.
+    """
+    if corpus is None:
+        corpus = synthetic_corpus(seed=seed)
+    rng = random.Random(seed)
+    cases = rng.sample(corpus, queries // 2)
+    cases.extend(synthetic_corpus(queries // 2, seed + 1))
+    results = {}
+    for name, make_scorer in suggestions.scorers.items():
+        scorer = make_scorer(corpus)
+        start = time.perf_counter()
+        results[name] = [scorer.best_matches(q, corpus, n=n) for q in cases]
+        elapsed = time.perf_counter() - start
+        print("{}: {:.0f} queries/second".format(name, len(cases) / elapsed))
+    for name, result in results.items():
+        assert result == results["fuzz"], name
+
+
+crash_script = """
+import os, signal, time
+import suggestions
+s = suggestions.Suggester("implement", write_behind=True, lazy=True,
+                          batch_size={batch_size},
+                          flush_interval={flush_interval},
+                          path={path!r})
+for i in range({n}):
+    s.set_cached_response("obs {{}}".format(i), "response", "benchmark")
+{before_kill}
+os.kill(os.getpid(), signal.SIGKILL)
+"""
+
+
+def crash_benchmark(n=250, batch_size=100, flush_interval=0.5):
+    """
+    Kill a process writing through a write-behind Suggester before it closes,
+    and check that it loses at most one batch, or nothing once a read
+    has come after flush_interval.
+    """
+    cases = [("killed", "", batch_size),
+             ("killed after a late read",
+              "time.sleep({}); s.get_cached_response('obs 0')".format(
+                  flush_interval), 0)]
+    with tempfile.TemporaryDirectory() as directory:
+        for k, (name, before_kill, max_lost) in enumerate(cases):
+            path = os.path.join(directory, "{}.db".format(k))
+            init_db.init_database(path)
+            script = crash_script.format(n=n,
+                                         batch_size=batch_size,
+                                         flush_interval=flush_interval,
+                                         path=path,
+                                         before_kill=before_kill)
+            subprocess.run([sys.executable, "-c", script],
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            with closing(sqlite3.connect(path)) as db:
+                (count, ), = db.execute("SELECT COUNT(*) FROM responses")
+            print("{}: {} of {} writes lost".format(name, n - count, n))
+            assert n - count <= max_lost
+
+
+def nested_message(depth, n):
+    m = Message("leaf []", Pointer(n))
+    for i in range(depth):
+        m = Message("level {} [] and []".format(i), m, Pointer(n))
+    return m
+
+
+def full_machine(depth):
+    """
+    A machine with every register full of deeply nested messages
+    """
+    env = main.RegisterMachine(
+        args=tuple(Message("arg {}".format(k))
+                   for k in range(main.RegisterMachine.max_registers)))
+    for k in range(env.max_registers):
+        env = env.add_register(nested_message(depth, k), contextualize=False)
+    return env
+
+
+def render_from_scratch(env):
+    """
+    Render env the way RegisterMachine.__str__ did before it cached anything
+    """
+
+    def render(m):
+        if not isinstance(m, Message):
+            return str(m)
+        return m.format_with([render(f) if not isinstance(f, Message) else
+                              "({})".format(render(f)) for f in m.fields])
+
+    result = []
+    for i, r in enumerate(env.registers):
+        prefix = "{}. ".format(i)
+        for m in r.contents:
+            result.append("{}{}".format(prefix, render(m)))
+            prefix = " " * len(prefix)
+        result.append("")
+    return "\n".join(result)
+
+
+def render_benchmark(depth=30, steps=500):
+    """
+    Time rendering observations of a full machine
+    in which one register is replaced at each step.
+    """
+    env = full_machine(depth)
+    states = []
+    for step in range(steps):
+        n = step % env.max_registers
+        env = env.add_register(nested_message(depth, n),
+                               n=n,
+                               replace=True,
+                               contextualize=False)
+        states.append(env)
+    for name, render in [("from scratch", render_from_scratch),
+                         ("cached", str)]:
+        start = time.perf_counter()
+        for env in states:
+            render(env)
+        elapsed = time.perf_counter() - start
+        print("{}: {:.1f} us per observation".format(name, 1e6 * elapsed /
+                                                     steps))
+    assert all(str(env) == render_from_scratch(env) for env in states)
+
+
+def memory_benchmark(steps=3000):
+    """
+    Measure the memory kept alive per machine step,
+    when every state and command along the way is retained.
+    """
+    script = ["ask what cell contains the agent in grid #0?", "view 1",
+              "clear 1", "ask move the agent e in grid #0", "clear 1"]
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    world = worlds.default_world()
+    head = Message("move the agent to the goal in grid []",
+                   messages.WorldMessage(world))
+    env = main.RegisterMachine()
+    env = env.add_register(env.make_head(head))
+    history = []
+    for step in range(steps):
+        s = script[step % len(script)]
+        cmd = commands.parse_command(s).copy(string=s, state=env)
+        _, env, cmd = cmd.execute()
+        history.append((env, cmd))
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:.0f} bytes per step".format((used - start) / steps))
+    return history
+
+
+def copy_by_constructor(x, **kwargs):
+    """
+    Copy x the way Copyable did before it generated copiers
+    """
+    for k in x.arg_names:
+        if k not in kwargs: kwargs[k] = getattr(x, k)
+    return x.__class__(**kwargs)
+
+
+def copy_benchmark(n=100000):
+    """
+    Compare copies per second of generated copiers and the generic copy
+    """
+    env = full_machine(5)
+    register = env.registers[1]
+    m = register.contents[0]
+    cmd = commands.parse_command("ask what is #1?").copy(state=env)
+    cases = [(m, {"fields": m.fields}), (register, {"cmd": None}),
+             (cmd, {"budget_consumed": 1}), (env, {"budget_consumed": 1})]
+    for x, kwargs in cases:
+        x.copy()  # generate the copier
+        for name, copy in [("generic", copy_by_constructor),
+                           ("generated", type(x).copy)]:
+            start = time.perf_counter()
+            for _ in range(n):
+                copy(x, **kwargs)
+            elapsed = time.perf_counter() - start
+            print("{} {}: {:.0f} copies/second".format(
+                type(x).__name__, name, n / elapsed))
+
+
+def random_walk(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice("nsew") for _ in range(n)]
+
+
+def world_benchmark(n=20000, seed=0):
+    """
+    Compare moves per second of the tuple and array world engines
+    on the same random walk, checking that they agree at every step.
+    """
+    random.seed(seed)
+    start_world = worlds.default_world()
+    walk = random_walk(n, seed)
+    results = {}
+    for name, world in [("tuple", start_world),
+                        ("array", worlds.ArrayWorld.from_world(start_world))]:
+        history = []
+        start = time.perf_counter()
+        for direction in walk:
+            world, moved = worlds.move_person(world, direction)
+            history.append((world, moved))
+        elapsed = time.perf_counter() - start
+        print("{}: {:.0f} moves/second".format(name, n / elapsed))
+        results[name] = history
+    for (t, t_moved), (a, a_moved) in zip(results["tuple"], results["array"]):
+        assert t_moved == a_moved
+        assert worlds.world_repr(t) == worlds.world_repr(a)
+        assert worlds.agent_cell(t) == worlds.agent_cell(a)
+    assert a.to_world()[0] == t[0]
+
+
+def history_benchmark(n=20000, seed=0):
+    """
+    Measure the memory kept alive per move by each engine's history,
+    and the time to rebuild past states of the array engine.
+    """
+    random.seed(seed)
+    start_world = worlds.default_world()
+    walk = random_walk(n, seed)
+    for name, world in [("tuple", start_world),
+                        ("array", worlds.ArrayWorld.from_world(start_world))]:
+        tracemalloc.start()
+        start, _ = tracemalloc.get_traced_memory()
+        for direction in walk:
+            world, moved = worlds.move_person(world, direction)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{}: {:.0f} bytes per move".format(name, (used - start) / n))
+    start = time.perf_counter()
+    for k in range(0, len(world.history), 97):
+        world.past(k)
+    elapsed = time.perf_counter() - start
+    print("rebuilt {} past states in {:.3f}s".format(
+        len(range(0, len(world.history), 97)), elapsed))
+
+
+def batch_benchmark(n=2000, steps=50, seed=0):
+    """
+    Step n worlds with the scalar and batched engines on the same random
+    directions, checking that moves and looks agree, and compare their
+    throughput in world-moves per second.
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    start_worlds = [worlds.default_world() for _ in range(n)]
+    walks = [[rng.choice("nsew") for _ in range(n)] for _ in range(steps)]
+    probes = [[worlds.X(rng.randint(-1, worlds.height),
+                        rng.randint(-1, worlds.width)) for _ in range(n)]
+              for _ in range(steps)]
+
+    start = time.perf_counter()
+    scalar = start_worlds
+    scalar_moved, scalar_looks = [], []
+    for walk, probe in zip(walks, probes):
+        results = [worlds.move_person(w, d) for w, d in zip(scalar, walk)]
+        scalar = [w for w, _ in results]
+        scalar_moved.append([moved for _, moved in results])
+        scalar_looks.append([worlds.look(w, c) for w, c in zip(scalar, probe)])
+    elapsed = time.perf_counter() - start
+    print("scalar: {:.0f} world-moves/second".format(n * steps / elapsed))
+
+    start = time.perf_counter()
+    batch = worlds.WorldBatch.from_worlds(start_worlds)
+    batch_moved, batch_looks = [], []
+    for walk, probe in zip(walks, probes):
+        batch, moved = batch.move_person(walk)
+        batch_moved.append(moved.tolist())
+        batch_looks.append(batch.look(probe))
+    elapsed = time.perf_counter() - start
+    print("batch: {:.0f} world-moves/second".format(n * steps / elapsed))
+
+    assert scalar_moved == batch_moved
+    assert scalar_looks == batch_looks
+    assert all(
+        worlds.world_repr(w) == worlds.world_repr(batch.world(k))
+        and worlds.agent_cell(w) == batch.world(k).agent
+        for k, w in enumerate(scalar))
+    new_worlds, moved = worlds.batch_move_person(scalar[:100], walks[0][:100])
+    for w, d, new_world, m in zip(scalar, walks[0], new_worlds, moved):
+        expected, expected_moved = worlds.move_person(w, d)
+        assert m == expected_moved
+        assert worlds.world_repr(new_world) == worlds.world_repr(expected)
+        if m:
+            assert worlds.world_repr(new_world.previous) == worlds.world_repr(w)
+
+
+def generation_benchmark(n=2000, seed=0):
+    """
+    Compare worlds per second of default_world and generate_world,
+    and check that generated worlds can be regenerated from their seeds.
+    """
+    start = time.perf_counter()
+    for _ in range(n):
+        worlds.default_world()
+    elapsed = time.perf_counter() - start
+    print("default_world: {:.0f} worlds/second".format(n / elapsed))
+    stream = worlds.world_stream(seed)
+    start = time.perf_counter()
+    generated = [next(stream) for _ in range(n)]
+    elapsed = time.perf_counter() - start
+    print("generate_world: {:.0f} worlds/second".format(n / elapsed))
+    for world_seed, world in generated[:100]:
+        assert (worlds.world_repr(worlds.generate_world(world_seed)) ==
+                worlds.world_repr(world))
+
+
+def large_grid_benchmark(sizes=(11, 200, 1000), n=20000, seed=0):
+    """
+    Show that moves and viewport rendering of array worlds
+    cost about the same however large the grid is.
+    """
+    walk = random_walk(n, seed)
+    for size in sizes:
+        world = worlds.generate_world(seed, width=size, height=size)
+        start = time.perf_counter()
+        for direction in walk:
+            world, moved = worlds.move_person(world, direction)
+        elapsed = time.perf_counter() - start
+        print("{0}x{0}: {1:.0f} moves/second".format(size, n / elapsed))
+        start = time.perf_counter()
+        for _ in range(100):
+            top, left = worlds.viewport(world, 21, 41)
+            worlds.world_repr(world, top, left, 21, 41)
+        elapsed = time.perf_counter() - start
+        print("{0}x{0}: {1:.0f} us per 21x41 viewport".format(
+            size, 1e6 * elapsed / 100))
+
+
+def shortest_path_length(world, max_states=200000):
+    """
+    The number of moves to the goal found by breadth first search
+    over every reachable state, None if there is no path,
+    or False if there are more than max_states states
+    """
+    def key(w):
+        return w.cells.to_bytes(), w.agent.x, w.agent.y
+
+    start = worlds.as_array_world(world)
+    seen = {key(start)}
+    frontier = [start]
+    distance = 0
+    while frontier:
+        next_frontier = []
+        for w in frontier:
+            if w.flags(w.agent) & worlds.GOAL:
+                return distance
+            for direction in worlds.move_names:
+                new_world, moved = w.move_person(direction)
+                if moved and key(new_world) not in seen:
+                    seen.add(key(new_world))
+                    next_frontier.append(new_world)
+        if len(seen) > max_states:
+            return False
+        frontier = next_frontier
+        distance += 1
+    return None
+
+
+def pushed_worlds(n=400, size=7, steps=30, seed=0):
+    """
+    Small generated worlds, and worlds reached from them by random walks
+    that pushed blocks around, sometimes onto the goal
+    """
+    rng = random.Random(seed)
+    result = []
+    for world_seed in range(n // 2):
+        world = worlds.generate_world(world_seed, width=size, height=size)
+        result.append(world)
+        for direction in random_walk(steps, rng.getrandbits(32)):
+            world, _ = worlds.move_person(world, direction)
+        result.append(world)
+    return result
+
+
+def check_oracle(world):
+    """
+    Check that the Oracle's plan for world can be executed, reaches the goal,
+    and is as short as breadth first search finds, unless it gave up
+    """
+    oracle = worlds.Oracle(world)
+    plan = oracle.plan()
+    expected = shortest_path_length(world)
+    if expected is False:
+        return
+    if plan is None:
+        assert expected is None
+        return
+    for direction in plan:
+        world, moved = worlds.move_person(world, direction)
+        assert moved
+    assert world.flags(world.agent) & worlds.GOAL
+    assert oracle.gave_up or len(plan) == expected
+
+
+def oracle_benchmark(sizes=(11, 50, 200, 1000), seed=0):
+    """
+    Check the Oracle's plans against breadth first search on small worlds,
+    then time building the distance fields of an Oracle,
+    and planning a path to the goal, as the grid grows.
+    """
+    for world in pushed_worlds(seed=seed):
+        check_oracle(world)
+    for size in sizes:
+        world = worlds.generate_world(seed, width=size, height=size)
+        start = time.perf_counter()
+        oracle = worlds.Oracle(world)
+        built = time.perf_counter()
+        plan = oracle.plan()
+        planned = time.perf_counter()
+        print("{0}x{0}: built in {1:.3f}s, planned {2} moves in {3:.3f}s{4}".
+              format(size, built - start, "no" if plan is None else len(plan),
+                     planned - built, " (gave up)" if oracle.gave_up else ""))
+
+
+def transposition_benchmark(steps=5000, seed=0):
+    """
+    Ask builtin questions along a random walk, which keeps returning
+    to the same states, with and without the transposition table.
+    """
+    questions = [
+        "what direction moves the agent closer to the goal in grid []?",
+        "what cell contains the agent in grid []?",
+    ] + ["move the agent {} in grid []".format(d) for d in "nsew"]
+    walk = random_walk(steps, seed)
+    for name, maxsize in [("uncached", 0), ("cached", 100000)]:
+        commands.builtin_answers.clear()
+        commands.builtin_answers.resize(maxsize)
+        cache = commands.builtin_answers
+        cache.hits = cache.misses = cache.evictions = 0
+        worlds.oracle_cache.clear()
+        world = worlds.intern_world(worlds.generate_world(seed))
+        moves = 0
+        start = time.perf_counter()
+        for direction in walk:
+            grid = messages.WorldMessage(world)
+            for q in questions:
+                commands.builtin_handler(Message(q, grid))
+            answer = commands.builtin_handler(
+                Message("move the agent {} in grid []".format(direction),
+                        grid))
+            if answer.matches("the resulting grid is []"):
+                world = answer.fields[0].world
+                moves += 1
+        elapsed = time.perf_counter() - start
+        print("{}: {:.0f} questions/second".format(
+            name, steps * (len(questions) + 1) / elapsed))
+        assert len(worlds.trajectory(world)) == moves + 1
+    print(commands.builtin_cache_stats())
+    q = Message(questions[1], messages.WorldMessage(world))
+    commands.builtin_answers[commands.answer_key(q)] = ((None, ),
+                                                         Message("stale"))
+    assert not commands.builtin_handler(q).matches("stale")
+    commands.builtin_answers.resize(100000)
+
+
+if __name__ == "__main__":
+    index_benchmark()
+    scorer_benchmark()
+    crash_benchmark()
+    parser_benchmark()
+    render_benchmark()
+    memory_benchmark()
+    copy_benchmark()
+    world_benchmark()
+    history_benchmark()
+    batch_benchmark()
+    generation_benchmark()
+    large_grid_benchmark()
+    oracle_benchmark()
+    transposition_benchmark()
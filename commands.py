@@ -1,4 +1,4 @@
-import pyparsing as pp
+import string
 import utils
 from messages import Message, Pointer
 import messages
@@ -25,7 +25,9 @@ class Command(utils.Copyable):
     and potentially returns a value.
     """
 
+    __slots__ = ("string", "state", "budget_consumed")
     command_args = []
+    copy_directly = True  # __init__ only stores its arguments
 
     @property
     def arg_names(self):
@@ -56,7 +58,7 @@ class Malformed(Command):
     """
     A command that is syntactically malformed (will typically result in an error)
     """
-    pass
+    __slots__ = ()
 
 
 def requires_register(f):
@@ -77,6 +79,7 @@ def requires_register(f):
 
 
 class Interrupted(Command):
+    __slots__ = ("exhausted", "previous")
     command_args = ["exhausted", "previous"]
 
     def __init__(self, exhausted=True, previous=None, **kwargs):
@@ -91,6 +94,7 @@ class Interrupted(Command):
 
 class Ask(Command):
 
+    __slots__ = ("question", "nominal_budget", "result_cmd")
     command_args = ["question", "nominal_budget", "result_cmd"]
     def __init__(self, question, nominal_budget=None, result_cmd=None, **kwargs):
         super().__init__(**kwargs)
@@ -148,50 +152,209 @@ class Ask(Command):
         return self if self.result_cmd is None else self.result_cmd
 
 
+builtin_questions = {}  # Message.text -> (handler, direction)
+
+
+def register_builtin(question, handler, direction=None):
+    """
+    Answer questions whose text is question with handler(Q, direction)
+
+    The handler may return None to decline.
+    """
+    builtin_questions[tuple(question.split("[]"))] = (handler, direction)
+
+
+def builtin(question, directional=False):
+    """
+    Decorator that registers a builtin handler.
+
+    If directional, question has a {} that is filled in with each direction,
+    and the direction gets passed to the handler.
+    """
+
+    def register(handler):
+        if directional:
+            for direction in worlds.directions:
+                register_builtin(question.format(direction), handler, direction)
+        else:
+            register_builtin(question, handler)
+        return handler
+
+    return register
+
+
+#transposition table: answer_key(Q) -> (world_states(Q), answer),
+#for builtin questions
+builtin_answers = utils.LRUCache(maxsize=100000)
+
+
+def answer_key(m):
+    """
+    A hashable key that is the same for any two messages
+    that builtins can't tell apart, identifying grids by their state
+    """
+    if isinstance(m, messages.WorldMessage):
+        return ("grid", worlds.world_hash(m.world))
+    if isinstance(m, messages.CellMessage):
+        return ("cell", m.cell.x, m.cell.y, m.cell.bounds)
+    if isinstance(m, Message):
+        return (m.text, tuple(answer_key(f) for f in m.fields))
+    return m
+
+
+def world_states(m):
+    """
+    The states of the grids in m, which a hit on answer_key(m)
+    must match, in case two states hash alike
+    """
+    if isinstance(m, messages.WorldMessage):
+        return (worlds.state_key(m.world), )
+    if isinstance(m, messages.CellMessage):
+        return ()
+    if isinstance(m, Message):
+        return tuple(s for f in m.fields for s in world_states(f))
+    return ()
+
+
+def rebase_answer(answer, Q):
+    """
+    answer, cached for a question about a grid in the same state as the one
+    in Q, with any grid it contains moved onto the history of the grid in Q
+
+    The only grids that builtins answer with are the results of one move
+    from the grid they were asked about.
+    """
+    asked = [f.world for f in Q.fields if isinstance(f, messages.WorldMessage)]
+    if answer is None or len(asked) != 1:
+        return answer
+    fields = []
+    for field in answer.fields:
+        if isinstance(field, messages.WorldMessage):
+            world = worlds.rebase(field.world, asked[0])
+            if world is not field.world:
+                field = messages.WorldMessage(world)
+        fields.append(field)
+    if all(a is b for a, b in zip(fields, answer.fields)):
+        return answer
+    return Message(answer.text, fields=tuple(fields))
+
+
 def builtin_handler(Q):
-    if Q.matches("what cell contains the agent in grid []?"):
-        world = messages.get_world(Q.fields[0])
-        if world is not None:
-            grid, agent, history = world
-            return Message("the agent is in cell []",
-                           messages.CellMessage(agent))
-    if Q.matches("what is in cell [] in grid []?"):
-        cell = messages.get_cell(Q.fields[0])
-        world = messages.get_world(Q.fields[1])
-        if cell is not None and world is not None:
-            return Message("it contains []", Message(worlds.look(world, cell)))
-    for direction in worlds.directions:
-        if Q.matches("is cell [] {} of cell []?".format(direction)):
-            a = messages.get_cell(Q.fields[0])
-            b = messages.get_cell(Q.fields[1])
-            if a is not None and b is not None:
-                if (a - b).in_direction(direction):
-                    return Message("yes")
-                else:
-                    return Message("no")
-        if Q.matches("move the agent {} in grid []".format(direction)):
-            world = messages.get_world(Q.fields[0])
-            if world is not None:
-                new_world, moved = worlds.move_person(world, direction)
-                if moved:
-                    return Message("the resulting grid is []",
-                                   messages.WorldMessage(new_world))
-                else:
-                    return Message("it can't move that direction")
-        if Q.matches("what cell is directly {} of cell []?".format(direction)):
-            cell = messages.get_cell(Q.fields[0])
-            if cell is not None:
-                new_cell, moved = cell.move(direction)
-                if moved:
-                    return Message("the cell []",
-                                   messages.CellMessage(new_cell))
-                else:
-                    return Message("there is no cell there")
-    return None
+    entry = builtin_questions.get(Q.text)
+    if entry is None:
+        return None
+    key = answer_key(Q)
+    states = world_states(Q)
+    cached = builtin_answers.get(key)
+    if cached is not None and cached[0] == states:
+        return rebase_answer(cached[1], Q)
+    handler, direction = entry
+    answer = handler(Q, direction)
+    builtin_answers[key] = (states, answer)
+    return answer
+
+
+def builtin_cache_stats():
+    stats = builtin_answers.stats()
+    stats["interned_worlds"] = len(worlds.world_table)
+    stats["world_hits"] = worlds.world_table.hits
+    stats["world_misses"] = worlds.world_table.misses
+    return stats
+
+
+@builtin("what cell contains the agent in grid []?")
+def agent_location(Q, direction):
+    world = messages.get_world(Q.fields[0])
+    if world is not None:
+        return Message("the agent is in cell []",
+                       messages.CellMessage(worlds.agent_cell(world)))
+
+
+@builtin("what is in cell [] in grid []?")
+def cell_contents(Q, direction):
+    cell = messages.get_cell(Q.fields[0])
+    world = messages.get_world(Q.fields[1])
+    if cell is not None and world is not None:
+        return Message("it contains []", Message(worlds.look(world, cell)))
+
+
+@builtin("is cell [] {} of cell []?", directional=True)
+def compare_cells(Q, direction):
+    a = messages.get_cell(Q.fields[0])
+    b = messages.get_cell(Q.fields[1])
+    if a is not None and b is not None:
+        if (a - b).in_direction(direction):
+            return Message("yes")
+        else:
+            return Message("no")
+
+
+@builtin("move the agent {} in grid []", directional=True)
+def move_agent(Q, direction):
+    world = messages.get_world(Q.fields[0])
+    if world is not None:
+        new_world, moved = worlds.move_person(world, direction)
+        if moved:
+            new_world = worlds.intern_world(new_world)
+            return Message("the resulting grid is []",
+                           messages.WorldMessage(new_world))
+        else:
+            return Message("it can't move that direction")
+
+
+@builtin("what cell is directly {} of cell []?", directional=True)
+def adjacent_cell(Q, direction):
+    cell = messages.get_cell(Q.fields[0])
+    if cell is not None:
+        new_cell, moved = cell.move(direction)
+        if moved:
+            return Message("the cell []", messages.CellMessage(new_cell))
+        else:
+            return Message("there is no cell there")
+
 
 
+@builtin("what direction moves the agent closer to the goal in grid []?")
+def direction_to_goal(Q, direction):
+    world = messages.get_world(Q.fields[0])
+    if world is not None:
+        oracle = worlds.get_oracle(world)
+        plan = oracle.plan()
+        if plan is None:
+            if not oracle.gave_up:
+                return Message("the agent can't reach the goal")
+        elif plan:
+            return Message("move it {}".format(plan[0]))
+        else:
+            return Message("the agent is already at the goal")
+
+
+@builtin("how many moves does the agent need to reach the goal in grid []?")
+def distance_to_goal(Q, direction):
+    world = messages.get_world(Q.fields[0])
+    if world is not None:
+        oracle = worlds.get_oracle(world)
+        plan = oracle.plan()
+        if not oracle.gave_up:
+            if plan is None:
+                return Message("the agent can't reach the goal")
+            return Message("it needs {} moves".format(len(plan)))
+
+
+@builtin("can the agent reach the goal in grid []?")
+def goal_reachable(Q, direction):
+    world = messages.get_world(Q.fields[0])
+    if world is not None:
+        oracle = worlds.get_oracle(world)
+        plan = oracle.plan()
+        if plan is not None:
+            return Message("yes")
+        if not oracle.gave_up:
+            return Message("no")
+
 class View(Command):
 
+    __slots__ = ("n", )
     command_args = ["n"]
 
     def __init__(self, n, **kwargs):
@@ -210,6 +373,7 @@ class View(Command):
 
 class Say(Command):
 
+    __slots__ = ("message", )
     command_args = ["message"]
 
     def __init__(self, message, **kwargs):
@@ -232,6 +396,7 @@ class Say(Command):
 
 class Clear(Command):
 
+    __slots__ = ("n", )
     command_args = ["n"]
 
     def __init__(self, n, **kwargs):
@@ -255,6 +420,7 @@ def clear(n, env):
 
 class Replace(Command):
 
+    __slots__ = ("ns", "message")
     command_args = ["ns", "message"]
 
     def __init__(self, ns, message, **kwargs):
@@ -283,6 +449,7 @@ class Replace(Command):
 
 class Assert(Command):
 
+    __slots__ = ("assertion", "register", "result_cmd", "failed")
     command_args = ["assertion", "register", "result_cmd", "failed"]
     def __init__(self, assertion, register=None, result_cmd=None, failed=False, **kwargs):
         super().__init__(**kwargs)
@@ -347,6 +514,7 @@ class Assert(Command):
 
 class Reply(Command):
 
+    __slots__ = ("message", "result_cmd")
     command_args = ["message", "result_cmd"]
 
     def __init__(self, message, result_cmd=None, **kwargs):
@@ -380,6 +548,7 @@ class Reply(Command):
 
 class Raise(Command):
 
+    __slots__ = ("n", "message", "old_cmd")
     command_args = ["n", "message", "old_cmd"]
 
     def __init__(self, n, message, old_cmd=None, **kwargs):
@@ -411,6 +580,7 @@ class Raise(Command):
 
 class Fix(Command):
 
+    __slots__ = ("n", )
     command_args = ["n"]
 
     def __init__(self, n, **kwargs):
@@ -420,6 +590,8 @@ class Fix(Command):
 
 class Resume(Command):
 
+    __slots__ = ("n", "message", "nominal_budget", "question", "result_cmd",
+                 "register")
     command_args = ["n", "message", "nominal_budget", "question", "result_cmd",
                     "register"]
     def __init__(self, n, message, nominal_budget=None, question=None,
@@ -490,6 +662,8 @@ class Resume(Command):
 
 class More(Command):
 
+    __slots__ = ("n", "result_cmd", "nominal_budget", "question",
+                 "register")
     command_args = ["n", "result_cmd", "nominal_budget", "question", "register"
                     ]
     def __init__(self, n, result_cmd=None, nominal_budget=None, question=None,
@@ -585,117 +759,333 @@ class More(Command):
     #----parsing
 
 
-parse_cache = {}
+parse_cache = utils.LRUCache(maxsize=100000)
+
+
+def set_parse_cache_size(maxsize):
+    parse_cache.resize(maxsize)
+
 
+def parse_cache_stats():
+    return parse_cache.stats()
 
-def parse(t, string):
-    if (t, string) not in parse_cache:
+
+def parse(rule, string):
+    """
+    Parse the whole of string as an instance of rule,
+    one of the Parser methods (e.g. "command" or "message").
+
+    Returns Malformed() if string can't be parsed.
+    """
+    result = parse_cache.get((rule, string), utils.missing)
+    if result is utils.missing:
         try:
-            parse_cache[(t, string)] = t.parseString(string, parseAll=True)[0]
-        except pp.ParseException:
-            parse_cache[(t, string)] = Malformed()
-    return parse_cache[(t, string)]
+            result = Parser(string).parse_all(rule)
+        except ParseFailure:
+            result = Malformed()
+        parse_cache[(rule, string)] = result
+    return result
 
 
 def parse_reply(s):
-    return parse(reply_command, s)
+    return parse("reply", s)
 
 
 def parse_command(s):
-    return parse(command, s)
+    return parse("command", s)
 
 
 def parse_message(s):
-    return parse(message, s)
+    return parse("message", s)
 
 
 def parse_view(s):
-    return parse(view_command, s)
+    return parse("view", s)
 
 
 def parse_fix(s):
-    return parse(fix_command, s)
+    return parse("fix", s)
 
 
-def raw(s):
-    return pp.Literal(s).suppress()
+class ParseFailure(Exception):
+    pass
 
 
-def options(*xs):
-    result = pp.Literal(xs[0])
-    for x in xs[1:]:
-        result = result ^ pp.Literal(x)
-    return result
+whitespace = " \n\t\r"
+digits = "0123456789"
+prose_chars = frozenset(" ,!?+-/*.;:_<>=&%{}[]\'\"" + string.ascii_letters)
+
+
+class Parser(object):
+    """
+    A single pass recursive descent parser for commands and messages.
+
+    It accepts the same strings as the pyparsing grammar in reference_grammar,
+    and builds the same objects, but is much faster.
+    Each rule takes a position and returns a (result, new position) pair,
+    or raises ParseFailure.
+
+    Like the reference grammar, keywords may be preceded by whitespace
+    while prose may not, and alternatives are tried in order without
+    backtracking once one of them succeeds.
+    """
+
+    def __init__(self, s):
+        self.s = s.expandtabs()
+
+    def parse_all(self, rule):
+        result, i = getattr(self, rule)(0)
+        if self.skip(i) != len(self.s):
+            raise ParseFailure(i)
+        return result
+
+    def skip(self, i):
+        s = self.s
+        while i < len(s) and s[i] in whitespace:
+            i += 1
+        return i
+
+    def literal(self, i, *options):
+        i = self.skip(i)
+        for option in options:
+            if self.s.startswith(option, i):
+                return i + len(option)
+        raise ParseFailure(i)
+
+    def run(self, i, chars):
+        s = self.s
+        j = i
+        while j < len(s) and s[j] in chars:
+            j += 1
+        return j
+
+    def number(self, i, skip=True):
+        if skip: i = self.skip(i)
+        j = self.run(i, digits)
+        if j == i: raise ParseFailure(i)
+        return int(self.s[i:j]), j
+
+    def prose(self, i):
+        j = self.run(i, prose_chars)
+        return self.s[i:j], j
+
+    def message(self, i):
+        text, i = self.prose(i)
+        texts = [text]
+        fields = []
+        while True:
+            try:
+                field, i = self.argument(i)
+            except ParseFailure:
+                break
+            fields.append(field)
+            text, i = self.prose(i)
+            texts.append(text)
+        if texts == [""]:
+            raise ParseFailure(i)
+        return Message(text=tuple(texts), fields=tuple(fields)), i
+
+    def argument(self, i):
+        try:
+            j = self.literal(i, "(")
+            m, j = self.message(j)
+            return m, self.literal(j, ")")
+        except ParseFailure:
+            pass
+        if self.s.startswith("#", i):
+            n, j = self.number(i + 1, skip=False)
+            return Pointer(n), j
+        raise ParseFailure(i)
+
+    def body(self, i):
+        return self.message(self.skip(i))
+
+    def ask(self, i):
+        i = self.literal(i, "ask", "Q:", "Q")
+        kwargs = {}
+        try:
+            j = self.skip(self.literal(i, "1"))
+            k = self.run(j, "0")
+            if k > j:
+                kwargs["nominal_budget"] = int("1" + self.s[j:k])
+                i = k
+        except ParseFailure:
+            pass
+        question, i = self.body(i)
+        return Ask(question, **kwargs), i
+
+    def reply(self, i):
+        i = self.literal(i, "reply", "A:", "A", "return")
+        m, i = self.body(i)
+        return Reply(m), i
+
+    def say(self, i):
+        m, i = self.body(self.literal(i, "note"))
+        return Say(m), i
+
+    def numbered(self, i, keyword, cls):
+        n, i = self.number(self.literal(i, keyword))
+        return cls(n), i
+
+    def view(self, i):
+        return self.numbered(i, "view", View)
+
+    def clear(self, i):
+        return self.numbered(i, "clear", Clear)
+
+    def fix(self, i):
+        return self.numbered(i, "fix", Fix)
+
+    def more(self, i):
+        return self.numbered(i, "more", More)
+
+    def replace(self, i):
+        n, i = self.number(self.literal(i, "replace"))
+        ns = [n]
+        while True:
+            j = i
+            try:
+                j = self.literal(j, "and")
+            except ParseFailure:
+                pass
+            try:
+                n, i = self.number(j)
+            except ParseFailure:
+                break
+            ns.append(n)
+        try:
+            i = self.literal(i, "with")
+        except ParseFailure:
+            pass
+        m, i = self.body(i)
+        return Replace(ns, m), i
+
+    def raise_(self, i):
+        n, i = self.number(self.literal(i, "raise"))
+        m, i = self.body(i)
+        return Raise(n, m), i
+
+    def resume(self, i):
+        n, i = self.number(self.literal(i, "resume", "ask@", "reply"))
+        m, i = self.body(i)
+        return Resume(n, m), i
+
+    def assert_(self, i):
+        m, i = self.body(self.literal(i, "assert"))
+        return Assert(m), i
+
+    def command(self, i):
+        for rule in [self.ask, self.reply, self.say, self.view, self.clear,
+                     self.replace, self.raise_, self.fix, self.more,
+                     self.resume, self.assert_]:
+            try:
+                return rule(i)
+            except ParseFailure:
+                pass
+        raise ParseFailure(i)
+
 
+#----reference grammar
 
-w = pp.Empty()  # optional whitespace
+reference_grammars = {}
+
+
+def reference_parse(rule, string):
+    """
+    Parse string with the original pyparsing grammar.
+
+    Slow, and only used to check Parser against.
+    """
+    import pyparsing as pp
+    if not reference_grammars:
+        reference_grammars.update(reference_grammar())
+    try:
+        return reference_grammars[rule].parseString(string, parseAll=True)[0]
+    except pp.ParseException:
+        return Malformed()
+
+
+def reference_grammar():
+    import pyparsing as pp
+
+    def raw(s):
+        return pp.Literal(s).suppress()
+
+    def options(*xs):
+        result = pp.Literal(xs[0])
+        for x in xs[1:]:
+            result = result ^ pp.Literal(x)
+        return result
 
-number = pp.Word("0123456789").setParseAction(lambda t: int(t[0]))
-power_of_ten = (
-    pp.Literal("1") + pp.Word("0")).setParseAction(lambda t: int(t[0] + t[1]))
-prose = pp.Word(" ,!?+-/*.;:_<>=&%{}[]\'\"" + pp.alphas).leaveWhitespace()
+    w = pp.Empty()  # optional whitespace
 
-message_pointer = (raw("#") + number).leaveWhitespace()
-message_pointer.setParseAction(lambda x: Pointer(x[0]))
+    number = pp.Word("0123456789").setParseAction(lambda t: int(t[0]))
+    power_of_ten = (
+        pp.Literal("1") + pp.Word("0")).setParseAction(lambda t: int(t[0] + t[1]))
+    prose = pp.Word(" ,!?+-/*.;:_<>=&%{}[]\'\"" + pp.alphas).leaveWhitespace()
 
+    message_pointer = (raw("#") + number).leaveWhitespace()
+    message_pointer.setParseAction(lambda x: Pointer(x[0]))
 
-def message_action(xs):
-    text, fields = utils.unweave(xs)
-    if text == ("", ):
-        raise pp.ParseException("can't parse empty message")
-    return Message(text=text, fields=fields)
+    def message_action(xs):
+        text, fields = utils.unweave(xs)
+        if text == ("", ):
+            raise pp.ParseException("can't parse empty message")
+        return Message(text=text, fields=fields)
 
+    message = pp.Forward()
+    submessage = raw("(") + message + raw(")")
+    argument = submessage | message_pointer
+    literal_message = (
+        pp.Optional(prose,
+                    default="") + pp.ZeroOrMore(argument + pp.Optional(prose,
+                                                                       default=""))
+    ).setParseAction(message_action)
+    message << literal_message
 
-message = pp.Forward()
-submessage = raw("(") + message + raw(")")
-argument = submessage | message_pointer
-literal_message = (
-    pp.Optional(prose,
-                default="") + pp.ZeroOrMore(argument + pp.Optional(prose,
-                                                                   default=""))
-).setParseAction(message_action)
-message << literal_message
+    budget_modifier = power_of_ten + w
+    budget_modifier.setParseAction(lambda xs: ("nominal_budget", xs[0]))
 
-budget_modifier = power_of_ten + w
-budget_modifier.setParseAction(lambda xs: ("nominal_budget", xs[0]))
+    ask_modifiers = pp.Optional(budget_modifier)
+    ask_modifiers.setParseAction(lambda xs: dict(list(xs)))
 
-ask_modifiers = pp.Optional(budget_modifier)
-ask_modifiers.setParseAction(lambda xs: dict(list(xs)))
+    ask_command = (raw("ask") | raw("Q:") | raw("Q")) + ask_modifiers + w + message
+    ask_command.setParseAction(lambda xs: Ask(xs[1], **xs[0]))
 
-ask_command = (raw("ask") | raw("Q:") | raw("Q")) + ask_modifiers + w + message
-ask_command.setParseAction(lambda xs: Ask(xs[1], **xs[0]))
+    reply_command = (raw("reply") | raw("A:") | raw("A") |
+                     raw("return")) + w + message
+    reply_command.setParseAction(lambda xs: Reply(xs[0]))
 
-reply_command = (raw("reply") | raw("A:") | raw("A") |
-                 raw("return")) + w + message
-reply_command.setParseAction(lambda xs: Reply(xs[0]))
+    clear_command = (raw("clear")) + w + number
+    clear_command.setParseAction(lambda xs: Clear(xs[0]))
 
-clear_command = (raw("clear")) + w + number
-clear_command.setParseAction(lambda xs: Clear(xs[0]))
+    replace_command = (raw("replace")) + w + number + pp.ZeroOrMore(pp.Optional(
+        w + raw("and")) + w + number) + pp.Optional(w + raw("with")) + w + message
+    replace_command.setParseAction(lambda xs: Replace(xs[:-1], xs[-1]))
 
-replace_command = (raw("replace")) + w + number + pp.ZeroOrMore(pp.Optional(
-    w + raw("and")) + w + number) + pp.Optional(w + raw("with")) + w + message
-replace_command.setParseAction(lambda xs: Replace(xs[:-1], xs[-1]))
+    say_command = (raw("note")) + w + message
+    say_command.setParseAction(lambda xs: Say(xs[0]))
 
-say_command = (raw("note")) + w + message
-say_command.setParseAction(lambda xs: Say(xs[0]))
+    view_command = raw("view") + w + number
+    view_command.setParseAction(lambda xs: View(xs[0]))
 
-view_command = raw("view") + w + number
-view_command.setParseAction(lambda xs: View(xs[0]))
+    raise_command = raw("raise") + w + number + w + message
+    raise_command.setParseAction(lambda xs: Raise(xs[0], xs[1]))
 
-raise_command = raw("raise") + w + number + w + message
-raise_command.setParseAction(lambda xs: Raise(xs[0], xs[1]))
+    fix_command = raw("fix") + w + number
+    fix_command.setParseAction(lambda xs: Fix(xs[0]))
 
-fix_command = raw("fix") + w + number
-fix_command.setParseAction(lambda xs: Fix(xs[0]))
+    resume_command = (raw("resume") | raw("ask@") |
+                      raw("reply")) + w + number + w + message
+    resume_command.setParseAction(lambda xs: Resume(xs[0], xs[1]))
 
-resume_command = (raw("resume") | raw("ask@") |
-                  raw("reply")) + w + number + w + message
-resume_command.setParseAction(lambda xs: Resume(xs[0], xs[1]))
+    more_command = raw("more") + w + number
+    more_command.setParseAction(lambda xs: More(xs[0]))
 
-more_command = raw("more") + w + number
-more_command.setParseAction(lambda xs: More(xs[0]))
+    assert_command = raw("assert") + w + message
+    assert_command.setParseAction(lambda xs: Assert(xs[0]))
 
-assert_command = raw("assert") + w + message
-assert_command.setParseAction(lambda xs: Assert(xs[0]))
+    command = ask_command | reply_command | say_command | view_command | clear_command | replace_command | raise_command | fix_command | more_command | resume_command | assert_command
 
-command = ask_command | reply_command | say_command | view_command | clear_command | replace_command | raise_command | fix_command | more_command | resume_command | assert_command
+    return {"command": command, "message": message, "reply": reply_command,
+            "view": view_command, "fix": fix_command}
@@ -1,11 +1,21 @@
 import sqlite3
 from contextlib import closing
 
-def init_database():
-    with closing(sqlite3.connect("memoize.db")) as conn:
+schema_version = 1  # stored in PRAGMA user_version
+
+
+def create_indexes(c):
+    c.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS responses_by_kind_and_input ON responses (kind, input)")
+    c.execute("PRAGMA user_version = {}".format(schema_version))
+
+
+def init_database(path="memoize.db"):
+    with closing(sqlite3.connect(path)) as conn:
         c = conn.cursor()
         c.execute(
             "CREATE TABLE responses (input varchar, output varchar, source varchar, kind varchar)")
+        create_indexes(c)
         conn.commit()
 
 if __name__ == "__main__":
@@ -47,14 +47,47 @@ class Register(utils.Copyable):
     along with the command that most recently modified the register.
     """
 
+    __slots__ = ("contents", "cmd", "_rendered", "_pointers")
     arg_names = ["contents", "cmd"]
+    copy_directly = True
+    copy_resets = ("_rendered", "_pointers")
 
     def __init__(self, contents, cmd=None):
         self.contents = contents
         self.cmd = cmd
+        self._rendered = None
+        self._pointers = None
 
     def transform_contents(self, f):
-        return self.copy(contents=tuple(f(x) for x in self.contents))
+        contents = tuple(f(x) for x in self.contents)
+        if all(a is b for a, b in zip(contents, self.contents)):
+            return self
+        return self.copy(contents=contents)
+
+    @property
+    def pointers(self):
+        """
+        The argument numbers of the pointers in this register, in order of appearance
+        """
+        if self._pointers is None:
+            self._pointers = tuple(x.n for m in self.contents
+                                   for x in m.get_leaves()
+                                   if isinstance(x, Pointer))
+        return self._pointers
+
+    def render(self, i):
+        """
+        The text of this register when it is in position i, followed by a newline
+        """
+        if self._rendered is None or self._rendered[0] != i:
+            result = []
+            prefix = "{}. ".format(i)
+            for m in self.contents:
+                result.append("{}{}".format(prefix, m))
+                prefix = " " * len(prefix)
+            result.append("")
+            self._rendered = (i, '\n'.join(result))
+        return self._rendered[1]
 
 
 class RegisterMachine(utils.Copyable):
@@ -77,6 +110,7 @@ class RegisterMachine(utils.Copyable):
     arg_names = ["registers", "context", "args", "use_cache", "nominal_budget",
                  "budget", "budget_consumed", "parent_cmd",
                  "initial_nominal_budget"]
+    __slots__ = tuple(arg_names) + ("_arg_order", )
 
     def __init__(self,
                  registers=(),
@@ -89,6 +123,8 @@ class RegisterMachine(utils.Copyable):
                  budget_consumed=0,
                  parent_cmd=None):
         self.registers = registers
+        if not isinstance(args, utils.PersistentVector):
+            args = utils.PersistentVector(args)
         self.args = args
         self.context = context
         self.use_cache = use_cache
@@ -100,16 +136,10 @@ class RegisterMachine(utils.Copyable):
         self.budget = min(nominal_budget, budget)
         self.budget_consumed = budget_consumed
         self.parent_cmd = parent_cmd
+        self._arg_order = None
 
     def __str__(self):
-        result = []
-        for i, r in enumerate(self.registers):
-            prefix = "{}. ".format(i)
-            for m in r.contents:
-                result.append("{}{}".format(prefix, m))
-                prefix = " " * len(prefix)
-            result.append("")
-        return '\n'.join(result)
+        return '\n'.join(r.render(i) for i, r in enumerate(self.registers))
 
     def dump_and_print(self, message=""):
         if self.context.terminal.closed:
@@ -134,12 +164,13 @@ class RegisterMachine(utils.Copyable):
         def sub(field):
             nonlocal new_env_args
             if isinstance(field, Message):
-                new_env_args = new_env_args + (field, )
+                new_env_args = new_env_args.append(messages.intern(field))
                 return Pointer(len(new_env_args) - 1)
             else:
                 return field
 
-        return m.transform_fields(sub), self.copy(args=new_env_args)
+        new_m = messages.intern(m.transform_fields(sub))
+        return new_m, self.copy(args=new_env_args)
 
     def transform_register_fields(self, f):
         """
@@ -184,7 +215,9 @@ class RegisterMachine(utils.Copyable):
                     new_n += 1
                 return RegisterReference(new_n)
 
-        state = state.transform_register_fields(sub)
+        #only registers after an inserted register get renumbered
+        if not replace and n < len(new_registers) - 1:
+            state = state.transform_register_fields(sub)
         if replace: state = state.pack_args()
         return state
 
@@ -200,45 +233,65 @@ class RegisterMachine(utils.Copyable):
         Replace each pointer to argument n with new_m, then remove argument n
         """
 
-        def affected(m):
-            return isinstance(m, Pointer) and m.n == n
-
         def sub(m):
-            return new_m if affected(m) else m
+            return new_m if isinstance(m, Pointer) and m.n == n else m
+
+        def g(m):
+            return m.transform_fields_recursive(sub)
 
         def transform_register(r):
-            any_affected = False
-            for m in r.contents:
-                any_affected = any_affected or any(affected(l)
-                                                   for l in m.get_leaves())
-            return r.copy(cmd=cmd) if any_affected and cmd is not None else r
+            if n not in r.pointers:
+                return r
+            if cmd is not None:
+                r = r.copy(cmd=cmd)
+            return r.transform_contents(g)
 
+        #untouched registers are shared with self
         result = self.copy(
             registers=tuple(transform_register(r) for r in self.registers))
-        return result.transform_register_fields(sub).pack_args()
+        return result.pack_args()
+
+    @property
+    def arg_order(self):
+        """
+        The arguments that some pointer refers to, in order of first appearance.
+
+        Rebuilt for each state from every register's cached list of pointers,
+        which takes a step per pointer, but only walks the messages
+        of registers that are new since the last state.
+        """
+        if self._arg_order is None:
+            self._arg_order = tuple(
+                dict.fromkeys(n for r in self.registers for n in r.pointers))
+        return self._arg_order
 
     def pack_args(self):
         """
         Remove unused arguments,
         and renumber arguments based on first appearance.
         """
-        arg_order = {}
-        new_args = []
-        for register in self.registers:
-            for message in register.contents:
-                for x in message.get_leaves():
-                    if isinstance(x, Pointer) and x.n not in arg_order:
-                        arg_order[x.n] = len(arg_order)
-                        new_args.append(self.args[x.n])
-        new_args = tuple(new_args)
+        order = self.arg_order
+        arg_order = {n: k for k, n in enumerate(order)}
+        if len(arg_order) == len(self.args) and all(
+                k == v for k, v in arg_order.items()):
+            return self
+        new_args = utils.PersistentVector(self.args[n] for n in order)
 
         def sub(x):
-            if isinstance(x, Pointer):
+            if isinstance(x, Pointer) and arg_order[x.n] != x.n:
                 return Pointer(n=arg_order[x.n])
             else:
                 return x
 
-        return self.copy(args=new_args).transform_register_fields(sub)
+        def g(m):
+            return m.transform_fields_recursive(sub)
+
+        #registers whose pointers keep their numbers are shared
+        registers = tuple(
+            r.transform_contents(g) if any(arg_order[n] != n
+                                           for n in r.pointers) else r
+            for r in self.registers)
+        return self.copy(args=new_args, registers=registers)
 
     def make_child(self, Q, nominal_budget=float('inf'), cmd=None,
             initial_nominal_budget=None, **kwargs):
@@ -303,6 +356,7 @@ class Translator(RegisterMachine):
     There need to be 5 registers only to accomodate errors passing through.
     """
 
+    __slots__ = ()
     kind = "translate"
     max_registers = 5
     cost_to_ask_Q = 1
@@ -337,8 +391,8 @@ class Context(object):
 
     def __enter__(self):
         self.suggesters = {
-            "implement": suggestions.Suggester("implement"),
-            "translate": suggestions.Suggester("translate")
+            "implement": suggestions.SharedSuggester("implement", lazy=True),
+            "translate": suggestions.SharedSuggester("translate", lazy=True)
         }
         self.terminal.__enter__()
         return self
@@ -389,14 +443,70 @@ class UnwindRecursion(Exception):
         raise UnwindRecursion(self.n - 1)
 
 
-def get_response(env,
-                 kind,
-                 use_cache=True,
-                 replace_old=False,
-                 error_message=None,
-                 prompt=">> ",
-                 default=None,
-                 make_pre_suggestions=lambda: []):
+class ResponseRequest(object):
+    """
+    Yielded by get_response_steps and run_machine_steps
+    when they need a response from the context.
+
+    Whoever is driving the generator sends back (response, src),
+    from answer() or answer_async().
+    """
+
+    __slots__ = ("env", "obs", "kwargs")
+
+    def __init__(self, env, obs, kwargs):
+        self.env = env
+        self.obs = obs
+        self.kwargs = kwargs
+
+    def answer(self):
+        return self.env.context.get_response(self.env, self.obs, **self.kwargs)
+
+    async def answer_async(self):
+        context = self.env.context
+        if hasattr(context, "get_response_async"):
+            return await context.get_response_async(self.env, self.obs,
+                                                    **self.kwargs)
+        return self.answer()
+
+
+def drive(steps):
+    """
+    Run a generator of ResponseRequests to completion,
+    answering each one as it comes, and return its result
+    """
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(request.answer())
+    except StopIteration as e:
+        return e.value
+
+
+async def drive_async(steps):
+    """
+    Like drive, but awaits each answer so that other machines can run
+    """
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await request.answer_async())
+    except StopIteration as e:
+        return e.value
+
+
+def get_response(env, kind, **kwargs):
+    return drive(get_response_steps(env, kind, **kwargs))
+
+
+def get_response_steps(env,
+                       kind,
+                       use_cache=True,
+                       replace_old=False,
+                       error_message=None,
+                       prompt=">> ",
+                       default=None,
+                       make_pre_suggestions=lambda: []):
     if error_message is not None:
         replace_old = True
     context = env.context
@@ -417,20 +527,27 @@ def get_response(env,
             hints = [h for h in hints if h != pre_suggestions[-1]]
             hints = [pre_suggestions[-1]] + hints
         if default is None: default = ""
-        response, src = context.get_response(env,
-                                             obs,
-                                             prompt=prompt,
-                                             pre_suggestions=pre_suggestions,
-                                             error_message=error_message,
-                                             default=default,
-                                             suggestions=hints,
-                                             shortcuts=shortcuts)
+        response, src = yield ResponseRequest(
+            env, obs, dict(prompt=prompt,
+                           pre_suggestions=pre_suggestions,
+                           error_message=error_message,
+                           default=default,
+                           suggestions=hints,
+                           shortcuts=shortcuts))
         if use_cache:
             suggester.set_cached_response(obs, response, src)
     return response
 
 
 def run_machine(state):
+    return drive(run_machine_steps(state))
+
+
+async def run_machine_async(state):
+    return await drive_async(run_machine_steps(state))
+
+
+def run_machine_steps(state):
     command = None
     retval = None
     error = None
@@ -465,12 +582,13 @@ def run_machine(state):
                     error_message = error
                 else:
                     error_message = "{}: {}".format(error, error_cmd.string)
-            s = get_response(state,
-                             error_message=error_message,
-                             use_cache=state.use_cache,
-                             prompt=state.prompt,
-                             kind=state.kind,
-                             make_pre_suggestions=make_pre_suggestions)
+            s = yield from get_response_steps(
+                state,
+                error_message=error_message,
+                use_cache=state.use_cache,
+                prompt=state.prompt,
+                kind=state.kind,
+                make_pre_suggestions=make_pre_suggestions)
             command = commands.parse_command(s)
             command = command.copy(string=s, state=state)
             if fixing_cmd is not None and s == error_cmd.string:
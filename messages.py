@@ -1,8 +1,11 @@
 import utils
 import six
+import weakref
 
 
 class Referent(utils.Copyable):
+    __slots__ = ("__weakref__", )
+
     def instantiate(self, xs):
         raise NotImplemented()
 
@@ -11,12 +14,23 @@ class BadInstantiation(Exception):
     pass
 
 
+comparing = set()  # (id, id) of the pairs of messages being compared
+
+
 class Message(Referent):
     """
     A Message consists of text interspersed with Referents
+
+    Messages compare and hash by value.
+    The hash is computed once, and must not be taken while pending.
+    A message that refers back to itself, as copies of world and cell
+    messages do, is compared by identity where the cycle closes.
     """
 
+    __slots__ = ("text", "fields", "pending", "_hash", "_str")
     arg_names = ["text", "fields", "pending"]
+    copy_directly = True
+    copy_resets = ("_hash", "_str")
 
     def __init__(self, text, *positional_fields, fields=(), pending=False):
         if isinstance(text, six.string_types):
@@ -25,6 +39,8 @@ class Message(Referent):
         self.fields = fields or positional_fields  #can either give fields as positional args, or fields=tuple
         assert positional_fields == () or fields == ()  #but can't do both
         self.pending = pending  #if pending, fields will be finalized later
+        self._hash = None
+        self._str = None
         if not pending:
             assert self.well_formed()
 
@@ -34,6 +50,9 @@ class Message(Referent):
         self.pending = False
         assert self.well_formed()
 
+    def valid_copy(self):
+        return self.pending or self.well_formed()
+
     def matches(self, text):
         target = tuple(text.split("[]"))
         return target == self.text
@@ -48,6 +67,27 @@ class Message(Referent):
     def size(self):
         return len(self.fields)
 
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self) or self.text != other.text:
+            return False
+        pair = (id(self), id(other))
+        if pair in comparing:
+            return False
+        comparing.add(pair)
+        try:
+            return self.fields == other.fields
+        finally:
+            comparing.discard(pair)
+
+    def __hash__(self):
+        if self._hash is None:
+            assert not self.pending
+            self._hash = hash(self.text)  # placeholder, in case of cycles
+            self._hash = hash((self.text, self.fields))
+        return self._hash
+
     def __add__(self, other):
         joined = self.text[-1] + other.text[0]
         return Message(
@@ -58,11 +98,16 @@ class Message(Referent):
         return "".join(utils.interleave(self.text, field_strings))
 
     def __str__(self):
+        if self._str is not None:
+            return self._str
+
         def f(field):
             return "({})".format(field) if isinstance(field,
                                                       Message) else str(field)
 
-        return self.format_with([f(field) for field in self.fields])
+        result = self.format_with([f(field) for field in self.fields])
+        if not self.pending: self._str = result
+        return result
 
     def instantiate(self, args):
         """
@@ -83,7 +128,13 @@ class Message(Referent):
             else:
                 return f(a)
 
-        result.finalize_fields(tuple(sub(a) for a in self.fields))
+        fields = tuple(sub(a) for a in self.fields)
+        if type(self) is Message and all(
+                a is b for a, b in zip(fields, self.fields)):
+            #share unchanged messages, along with their cached renderings
+            cache[self] = self
+            return self
+        result.finalize_fields(fields)
         return result
 
     def transform_fields(self, f):
@@ -108,7 +159,9 @@ class WorldMessage(Message):
     usable if you view it.
     """
 
+    __slots__ = ("world", )
     arg_names = ["world"]
+    copy_directly = False
 
     def __init__(self, world):
         self.world = world
@@ -118,6 +171,12 @@ class WorldMessage(Message):
     def __str__(self):
         return "<<gridworld grid>>"
 
+    def __eq__(self, other):
+        return type(other) is type(self) and self.world is other.world
+
+    def __hash__(self):
+        return id(self.world)
+
 
 def get_world(m):
     if isinstance(m, WorldMessage):
@@ -135,7 +194,9 @@ class CellMessage(Message):
     usable if you view it.
     """
 
+    __slots__ = ("cell", )
     arg_names = ["cell"]
+    copy_directly = False
 
     def __init__(self, cell):
         self.cell = cell
@@ -145,6 +206,12 @@ class CellMessage(Message):
     def __str__(self):
         return "<<gridworld cell>>"
 
+    def __eq__(self, other):
+        return type(other) is type(self) and self.cell == other.cell
+
+    def __hash__(self):
+        return hash(self.cell)
+
 
 def get_cell(m):
     if isinstance(m, CellMessage):
@@ -197,12 +264,17 @@ class Pointer(Referent):
     """
     A Pointer is an integer that indexes into a list of arguments
     """
+    __slots__ = ("n", )
     arg_names = ["n"]
+    copy_directly = True
 
     def __init__(self, n):
         self.n = n
         assert self.well_formed()
 
+    def valid_copy(self):
+        return self.well_formed()
+
     def well_formed(self):
         return (isinstance(self.n, int))
 
@@ -215,3 +287,48 @@ class Pointer(Referent):
 
     def __str__(self):
         return "#{}".format(self.n)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.n == other.n
+
+    def __hash__(self):
+        return hash(("#", self.n))
+
+
+class InternTable(object):
+    """
+    Maps each message to a canonical instance,
+    so that identical messages share one object.
+
+    Only plain Messages and Pointers are interned.
+    Entries go away when nothing else refers to the canonical instance.
+    """
+
+    def __init__(self):
+        self.instances = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.instances)
+
+    def intern(self, m):
+        if type(m) is Pointer:
+            key = ("#", m.n)
+        elif type(m) is Message and not m.pending:
+            fields = tuple(self.intern(f) for f in m.fields)
+            if any(a is not b for a, b in zip(fields, m.fields)):
+                m = Message(text=m.text, fields=fields)
+            #fields are canonical, so they can be identified by id
+            key = (m.text, tuple(id(f) for f in fields))
+        else:
+            return m
+        canonical = self.instances.get(key)
+        if canonical is None:
+            self.instances[key] = canonical = m
+        return canonical
+
+
+intern_table = None  #set to an InternTable to share identical messages
+
+
+def intern(m):
+    return m if intern_table is None else intern_table.intern(m)
@@ -1,5 +1,7 @@
 import sqlite3
+from contextlib import closing
 from utils import starts_with
+import init_db
 
 def standardize_response(r):
     subs = {
@@ -36,3 +38,27 @@ def standardize_all_responses():
         db.commit()
     finally:
         db.close()
+
+
+def upgrade_schema():
+    """
+    Bring an existing memoize.db up to init_db.schema_version in place.
+
+    Duplicate (kind, input) rows are removed, keeping the most recent one,
+    which is the one that Suggester.load_cache would have used.
+    """
+    with closing(sqlite3.connect("memoize.db")) as db:
+        cursor = db.cursor()
+        version, = cursor.execute("PRAGMA user_version").fetchone()
+        if version >= init_db.schema_version:
+            return
+        cursor.execute(
+            "DELETE FROM responses WHERE rowid NOT IN "
+            "(SELECT MAX(rowid) FROM responses GROUP BY kind, input)")
+        print("removed {} duplicate responses".format(cursor.rowcount))
+        init_db.create_indexes(cursor)
+        db.commit()
+
+
+if __name__ == "__main__":
+    upgrade_schema()
@@ -1,4 +1,10 @@
+import asyncio
 import datetime
+import functools
+import random
+import sys
+import threading
+import time
 import worlds
 import main
 import messages
@@ -12,15 +18,134 @@ def now():
     return datetime.datetime.now(pytz.utc)
 
 
+class BackoffNotifier(object):
+    """
+    Waits for feedback by sleeping, for when nothing can tell us it arrived.
+
+    Each wait that turns up nothing doubles the delay, up to max_delay,
+    and reset() drops it back to min_delay once results arrive.
+    """
+
+    def __init__(self, min_delay=0.05, max_delay=5.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+
+    def notify(self):
+        pass
+
+    def wait(self):
+        time.sleep(self.delay)
+        self.delay = min(2 * self.delay, self.max_delay)
+
+    def reset(self):
+        self.delay = self.min_delay
+
+
+class LocalNotifier(object):
+    """
+    Waits for feedback until notify() is called, by whatever in this
+    process stores responses, or until timeout passes.
+
+    The timeout bounds how long a missed notification can stall a sweep.
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.notifications = 0
+        self.seen = 0
+
+    def notify(self):
+        with self.condition:
+            self.notifications += 1
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.notifications != self.seen,
+                                    self.timeout)
+            self.seen = self.notifications
+
+    def reset(self):
+        pass
+
+
+class InFlightRegistry(object):
+    """
+    The observations waiting on the server, shared by every ServerContext
+    in the process, so that each observation is sent to humans once.
+
+    Before creating a Feedback row, query checks the database for an
+    unanswered one, so processes share their questions as well.
+    sweep polls the rows of the observations still waiting, by id,
+    and hands each answer to every context waiting for it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = defaultdict(set)  # obs -> contexts waiting for it
+        self.feedback_ids = {}  # obs -> id of the Feedback row asking it
+        self.delivered = defaultdict(set)  # context -> obs answered for it
+
+    def query(self, context, obs, make_feedback):
+        """
+        Add context to the waiters for obs, calling make_feedback() to ask
+        the server unless the question is already out
+        """
+        with self.lock:
+            first = obs not in self.waiters
+            self.waiters[obs].add(context)
+        if first:
+            f = Feedback.objects.filter(dialog_context=obs,
+                                        responded_at__isnull=True,
+                                        canceled_at__isnull=True).first()
+            if f is None:
+                f = make_feedback()
+            with self.lock:
+                self.feedback_ids[obs] = f.id
+
+    def sweep(self):
+        with self.lock:
+            pending = list(self.feedback_ids.values())
+        if not pending:
+            return
+        answered = Feedback.objects.filter(id__in=pending,
+                                           responded_at__isnull=False)
+        with self.lock:
+            for f in answered:
+                if self.feedback_ids.get(f.dialog_context) != f.id:
+                    continue
+                del self.feedback_ids[f.dialog_context]
+                for context in self.waiters.pop(f.dialog_context, ()):
+                    context.results[f.dialog_context] = (f.response, f.rater)
+                    self.delivered[context].add(f.dialog_context)
+
+    def collect(self, context):
+        """
+        The observations answered for context since it last collected
+        """
+        with self.lock:
+            return self.delivered.pop(context, set())
+
+
+in_flight = InFlightRegistry()
+
+
 class ServerContext(object):
 
     supports_pre_suggestions = False
 
-    def __init__(self, experiment_name="gridworld-test", is_sandbox=False):
+    def __init__(self,
+                 experiment_name="gridworld-test",
+                 is_sandbox=False,
+                 notifier=None,
+                 registry=None):
         self.experiment_name = experiment_name
-        self.queried = set()
-        self.last_time = now()
+        self.notifier = BackoffNotifier() if notifier is None else notifier
+        self.registry = in_flight if registry is None else registry
         self.results = {}
+        self.futures = {}  # obs -> future resolved when its result arrives
         self.is_sandbox = is_sandbox
         fs = Feedback.objects.filter(responded_at__isnull=True,
                                      experiment_name=self.experiment_name)
@@ -28,10 +153,14 @@ class ServerContext(object):
 
     def __enter__(self):
         self.suggesters = {
-            "implement": suggestions.Suggester("implement",
-                                               num_suggestions=15),
-            "translate": suggestions.Suggester("translate",
-                                               num_suggestions=15),
+            "implement": suggestions.SharedSuggester("implement",
+                                                     num_suggestions=15,
+                                                     write_behind=True,
+                                                     lazy=True),
+            "translate": suggestions.SharedSuggester("translate",
+                                                     num_suggestions=15,
+                                                     write_behind=True,
+                                                     lazy=True),
         }
         return self
 
@@ -45,22 +174,42 @@ class ServerContext(object):
             del self.results[obs]
 
     def sweep(self):
-        new_results = set()
-        for f in Feedback.objects.filter(responded_at__gt=self.last_time,
-                                         experiment_name=self.experiment_name):
-            self.last_time = max(self.last_time, f.responded_at)
-            self.results[f.dialog_context] = (f.response, f.rater)
-            new_results.add(f.dialog_context)
-            #obs may not be in queried if it was pending when self was created
-            if f.dialog_context in self.queried:
-                self.queried.remove(f.dialog_context)
-        return new_results
+        self.registry.sweep()
+        return self.collect()
+
+    def collect(self):
+        """
+        The observations answered for this context by the last sweep
+        of its registry, which may have been run by another context
+        """
+        return self.registry.collect(self)
+
+    def flush_if_stale(self):
+        """
+        Commit writes that the suggesters have held for too long.
+        Call this from the thread that opened them, while waiting for results.
+        """
+        for v in self.suggesters.values():
+            v.flush_if_stale()
+
+    def wait_for_results(self):
+        """
+        Sweep until there are new results, waiting on the notifier in between
+        """
+        while True:
+            self.flush_if_stale()
+            new_results = self.sweep()
+            if new_results:
+                self.notifier.reset()
+                return new_results
+            self.notifier.wait()
 
     def get_response(self, env, obs, suggestions=[], **kwargs):
         if obs in self.results:
             response, rater = self.results[obs]
             return response, "remote:{}".format(rater)
-        if obs not in self.queried:
+
+        def make_feedback():
             print("querying server")
             print(obs)
             print("suggestions: {}".format(suggestions))
@@ -71,18 +220,73 @@ class ServerContext(object):
                          experiment_name=self.experiment_name)
             f.full_clean()
             f.save()
-            self.queried.add(obs)
+            return f
+
+        self.registry.query(self, obs, make_feedback)
         raise WaitingOnServer(env, obs)
 
 
+    async def get_response_async(self, env, obs, **kwargs):
+        """
+        Like get_response, but waits for the result
+        instead of raising WaitingOnServer
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            if obs in self.results:
+                return self.get_response(env, obs, **kwargs)
+            #made before asking, so that a result delivered meanwhile resolves it
+            future = self.futures.get(obs)
+            if future is None or future.done():
+                future = self.futures[obs] = loop.create_future()
+            try:
+                #the registry and Feedback queries block, so run them off the loop
+                return await loop.run_in_executor(
+                    None, functools.partial(self.get_response, env, obs,
+                                            **kwargs))
+            except WaitingOnServer:
+                await future
+
+    async def deliver_results(self):
+        """
+        Resolve the futures of observations as their results arrive,
+        until cancelled
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            self.flush_if_stale()
+            new_results = await loop.run_in_executor(None, self.sweep)
+            if not new_results:
+                await loop.run_in_executor(None, self.notifier.wait)
+                continue
+            self.notifier.reset()
+            for obs in new_results:
+                future = self.futures.pop(obs, None)
+                if future is not None:
+                    future.set_result(None)
+
+
 class WaitingOnServer(Exception):
     def __init__(self, env, obs):
         self.obs = obs
         self.env = env
 
 
-def default_machine(context):
-    world = worlds.default_world()
+def seeded_world_stream(seed=None):
+    """
+    A world stream started from seed, or from a fresh seed if it is None,
+    which is printed so that the run can be repeated
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    print("world stream seed: {}".format(seed))
+    return worlds.world_stream(seed)
+
+
+def default_machine(context, world_seeds):
+    seed, world = next(world_seeds)
+    print("world seed: {}".format(seed))
+    world = worlds.intern_world(world)
     Q = messages.Message(
         "move the agent to the goal in grid []", messages.WorldMessage(world))
     budget = 100000
@@ -90,8 +294,9 @@ def default_machine(context):
     return machine.add_register(machine.make_head(Q, budget))
 
 
-def run_many_machines():
-    with ServerContext() as context:
+def run_many_machines(notifier=None, seed=None):
+    world_seeds = seeded_world_stream(seed)
+    with ServerContext(notifier=notifier) as context:
         waiting = defaultdict(list)
         results = []
         machines = []
@@ -100,7 +305,7 @@ def run_many_machines():
             while True:
                 while (len(machines) + sum(len(v) for v in waiting.values()) <
                        active_machines):
-                    machines.append(default_machine(context))
+                    machines.append(default_machine(context, world_seeds))
                 if machines:
                     machine = machines.pop()
                     try:
@@ -108,7 +313,7 @@ def run_many_machines():
                     except WaitingOnServer as e:
                         waiting[e.obs].append(e.env)
                 elif waiting:
-                    for obs in context.sweep():
+                    for obs in context.wait_for_results():
                         machines.extend(waiting[obs])
                         del waiting[obs]
                 else:
@@ -119,4 +324,4 @@ def run_many_machines():
 
 
 if __name__ == '__main__':
-    run_many_machines()
+    run_many_machines(seed=int(sys.argv[1]) if len(sys.argv) > 1 else None)
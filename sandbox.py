@@ -1,24 +1,32 @@
-from remote_elicitation import ServerContext, WaitingOnServer
+from remote_elicitation import ServerContext, WaitingOnServer, BackoffNotifier
+from remote_elicitation import seeded_world_stream
 import messages
 import worlds
 import main
+import sys
 from collections import defaultdict
 
-def default_machine(context):
-    world = worlds.default_world()
+def default_machine(context, world_seeds):
+    seed, world = next(world_seeds)
+    print("{}: world seed {}".format(context.experiment_name, seed))
+    world = worlds.intern_world(world)
     Q = messages.Message("[] is a grid", messages.WorldMessage(world))
     budget = 100000
     machine = main.RegisterMachine(context=context, nominal_budget=budget)
     return machine.add_register(Q)
 
 #XXX this is very hacky
-def run_sandboxes():
+def run_sandboxes(notifier=None, seed=None, registry=None):
     active_machines = 10
+    world_seeds = seeded_world_stream(seed)
+    if notifier is None:
+        notifier = BackoffNotifier()
     try:
-        contexts = [ServerContext("sandbox-{}".format(i), is_sandbox=True) for i in range(active_machines)]
+        contexts = [ServerContext("sandbox-{}".format(i), is_sandbox=True, notifier=notifier, registry=registry) for i in range(active_machines)]
         for context in contexts:
             context.__enter__()
-        machines = [default_machine(context) for context in contexts]
+        machines = [default_machine(context, world_seeds) for context in contexts]
+        registry = contexts[0].registry  #shared by all the contexts
         waiting = defaultdict(list)
         results = []
         while True:
@@ -27,18 +35,24 @@ def run_sandboxes():
                 try:
                     results.append(main.run_machine(machine))
                     machine.context.results = {}
-                    machines.append(default_machine(machine.context))
+                    machines.append(default_machine(machine.context, world_seeds))
                 except WaitingOnServer as e:
                     waiting[e.obs].append(e.env)
             elif waiting:
+                registry.sweep()
                 for context in contexts:
-                    for obs in context.sweep():
+                    context.flush_if_stale()
+                    for obs in context.collect():
                         machines.extend(waiting[obs])
                         del waiting[obs]
+                if machines:
+                    notifier.reset()
+                else:
+                    notifier.wait()
             else:
                 return results
     finally:
         for context in contexts: context.__exit__()
 
 if __name__ == '__main__':
-    run_sandboxes()
+    run_sandboxes(seed=int(sys.argv[1]) if len(sys.argv) > 1 else None)
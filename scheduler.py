@@ -0,0 +1,171 @@
+import asyncio
+import random
+import time
+import main
+import messages
+import worlds
+
+
+class Scheduler(object):
+    """
+    Runs machines as asyncio tasks, at most max_active at a time.
+
+    Each machine awaits its context's responses,
+    so thousands can wait on humans in one process.
+    """
+
+    def __init__(self, make_machine, max_active=15):
+        self.make_machine = make_machine
+        self.max_active = max_active
+        self.finished = 0
+
+    async def run_one(self, semaphore):
+        async with semaphore:
+            result = await main.run_machine_async(self.make_machine())
+            self.finished += 1
+            return result
+
+    async def run(self, n):
+        """
+        Run n machines and return their results
+        """
+        semaphore = asyncio.Semaphore(self.max_active)
+        return await asyncio.gather(*(self.run_one(semaphore)
+                                      for _ in range(n)))
+
+
+def goal_machine(context, world, budget=100000):
+    Q = messages.Message("move the agent to the goal in grid []",
+                         messages.WorldMessage(world))
+    machine = main.RegisterMachine(context=context, nominal_budget=budget)
+    return machine.add_register(machine.make_head(Q, budget))
+
+
+def run_sync(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def run_remote(n, max_active=15, notifier=None, seed=None):
+    """
+    Run n machines against the feedback server,
+    on worlds from a stream started from seed
+    """
+    from remote_elicitation import (ServerContext, default_machine,
+                                    seeded_world_stream)
+    world_seeds = seeded_world_stream(seed)
+
+    async def run(context):
+        delivery = asyncio.ensure_future(context.deliver_results())
+        machines = asyncio.ensure_future(Scheduler(
+            lambda: default_machine(context, world_seeds),
+            max_active).run(n))
+        try:
+            #delivery only finishes by failing, and then its error is ours
+            await asyncio.wait([delivery, machines],
+                               return_when=asyncio.FIRST_COMPLETED)
+            if delivery.done():
+                delivery.result()
+            return machines.result()
+        finally:
+            machines.cancel()
+            delivery.cancel()
+            context.notifier.notify()
+            await asyncio.wait([delivery, machines])
+
+    with ServerContext(notifier=notifier) as context:
+        return run_sync(run(context))
+
+
+class NullSuggester(object):
+    """
+    A suggester with nothing cached and nothing to suggest
+    """
+
+    def get_cached_response(self, obs):
+        return None
+
+    def set_cached_response(self, obs, response, src):
+        pass
+
+    def delete_cached_response(self, obs):
+        pass
+
+    def make_suggestions_and_shortcuts(self, env, obs):
+        return [], []
+
+    def flush_if_stale(self):
+        pass
+
+
+def oracle_policy(env, obs):
+    """
+    Pass questions through translation, and solve the goal task
+    by asking the oracle for a direction and then replying;
+    give up on any other question.
+    """
+    head = messages.strip_prefix(env.registers[0].contents[0])
+    if isinstance(env, main.Translator):
+        if len(env.registers) == 1:
+            return "ask {}".format(head)
+        answer = env.registers[1].contents[1]
+        return "reply {}".format(messages.strip_prefix(answer))
+    if not head.matches("move the agent to the goal in grid []"):
+        return "reply I don't know"
+    if len(env.registers) == 1:
+        return "ask what direction moves the agent closer to the goal in grid #0?"
+    return "reply done"
+
+
+class SimulatedContext(object):
+    """
+    A context whose responses come from policy after a random delay
+    with mean mean_latency seconds, standing in for humans on the server
+    """
+
+    supports_pre_suggestions = False
+    is_sandbox = True
+
+    def __init__(self, policy=oracle_policy, mean_latency=1.0, seed=0):
+        self.policy = policy
+        self.mean_latency = mean_latency
+        self.rng = random.Random(seed)
+        self.suggesters = {
+            "implement": NullSuggester(),
+            "translate": NullSuggester()
+        }
+        self.responses = 0
+
+    def delete_cached_response(self, obs):
+        pass
+
+    def get_response(self, env, obs, **kwargs):
+        self.responses += 1
+        return self.policy(env, obs), "simulated"
+
+    async def get_response_async(self, env, obs, **kwargs):
+        await asyncio.sleep(self.rng.expovariate(1 / self.mean_latency))
+        return self.get_response(env, obs, **kwargs)
+
+
+def simulate(n=2000, max_active=1000, mean_latency=1.0, seed=0):
+    """
+    Run n machines against simulated humans and report throughput
+    """
+    context = SimulatedContext(mean_latency=mean_latency, seed=seed)
+    stream = worlds.world_stream(seed)
+    scheduler = Scheduler(lambda: goal_machine(context, next(stream)[1]),
+                          max_active)
+    start = time.perf_counter()
+    results = run_sync(scheduler.run(n))
+    elapsed = time.perf_counter() - start
+    print("{} machines, {} responses in {:.1f}s: {:.0f} machines/hour".format(
+        n, context.responses, elapsed, 3600 * n / elapsed))
+    return results
+
+
+if __name__ == "__main__":
+    simulate()
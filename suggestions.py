@@ -1,15 +1,33 @@
 from fuzzywuzzy import fuzz
+from fuzzywuzzy import utils as fuzz_utils
 from contextlib import closing
+from collections import Counter, defaultdict
+from math import ceil
 import heapq
+import time
+import utils
 import messages
 import commands
 import sqlite3
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def match(query, key):
     return fuzz.token_sort_ratio(query, key)
 
 
+def sorted_tokens(s):
+    """
+    The string that fuzz.token_sort_ratio compares in place of s
+    """
+    return " ".join(sorted(fuzz_utils.full_process(s, force_ascii=True).split()))
+
+
 def best_matches(query, keys, n=5):
     vs = {}
 
@@ -24,8 +42,278 @@ def best_matches(query, keys, n=5):
                   reverse=True)
 
 
-def best_dict_values(query, d, deduplicate=True, n=5, filter=lambda x: True):
-    keys = best_matches(query, d.keys(), n=3 * n)
+class FuzzScorer(object):
+    """
+    Scores keys one at a time with fuzz.token_sort_ratio.
+
+    This is the reference implementation that other scorers should agree with.
+    """
+
+    def __init__(self, keys=()):
+        pass
+
+    def add(self, key):
+        pass
+
+    def remove(self, key):
+        pass
+
+    def best_matches(self, query, keys, n=5):
+        return best_matches(query, keys, n=n)
+
+
+class ArrayScorer(object):
+    """
+    Ranks keys as fuzz.token_sort_ratio does, scoring as few of them as it can.
+
+    Each key is stored as a row counting the characters of its sorted token
+    string. Two strings can't share more characters than their counts have
+    in common, so one numpy operation bounds the score of every key,
+    and keys are scored exactly in order of their bounds until no remaining
+    key can reach the results.
+    """
+
+    def __init__(self, keys=()):
+        if np is None:
+            raise ImportError("ArrayScorer requires numpy")
+        self.alphabet = {}
+        self.counts = np.zeros((16, 8), dtype=np.int32)
+        self.lengths = np.zeros(16, dtype=np.int32)
+        self.rows = {}
+        self.free_rows = []
+        for key in keys:
+            self.add(key)
+
+    def char_counts(self, s):
+        counts = np.zeros(self.counts.shape[1], dtype=np.int32)
+        for c, k in Counter(s).items():
+            if c in self.alphabet: counts[self.alphabet[c]] = k
+        return counts
+
+    def reserve(self, num_rows, width):
+        rows, old_width = self.counts.shape
+        if num_rows <= rows and width <= old_width: return
+        new_shape = (max(rows, 2 * num_rows), max(old_width, width))
+        counts = np.zeros(new_shape, dtype=np.int32)
+        counts[:rows, :old_width] = self.counts
+        self.counts = counts
+        self.lengths = np.resize(self.lengths, new_shape[0])
+
+    def add(self, key):
+        if key in self.rows: return
+        s = sorted_tokens(key)
+        for c in s:
+            if c not in self.alphabet: self.alphabet[c] = len(self.alphabet)
+        row = self.free_rows.pop() if self.free_rows else len(self.rows)
+        self.reserve(row + 1, len(self.alphabet))
+        self.counts[row] = self.char_counts(s)
+        self.lengths[row] = len(s)
+        self.rows[key] = row
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None: return
+        self.counts[row] = 0
+        self.lengths[row] = 0
+        self.free_rows.append(row)
+
+    def bounds(self, query, keys):
+        """
+        An upper bound on match(query, k) for each of keys
+        """
+        s = sorted_tokens(query)
+        query_counts = self.char_counts(s)
+        rows = np.fromiter((self.rows[k] for k in keys), dtype=np.intp)
+        shared = np.minimum(self.counts[rows], query_counts).sum(axis=1)
+        totals = self.lengths[rows] + len(s)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bounds = np.rint(100 * (2.0 * shared / totals))
+        bounds[totals == 0] = 100
+        return bounds
+
+    def best_matches(self, query, keys, n=5):
+        keys = list(keys)
+        if not keys: return []
+        bounds = self.bounds(query, keys)
+        order = np.argsort(-bounds, kind="stable")
+        scored = []  # (-score, position) of every key scored so far
+        top = []  # the n best scores so far, lowest first
+        for i in order:
+            if len(top) == n and bounds[i] < top[0]: break
+            score = match(query, keys[i])
+            scored.append((-score, i))
+            if len(top) < n:
+                heapq.heappush(top, score)
+            elif score > top[0]:
+                heapq.heapreplace(top, score)
+        return [keys[i] for _, i in heapq.nsmallest(n, scored)]
+
+
+scorers = {"fuzz": FuzzScorer, "array": ArrayScorer}
+
+
+def tokenize(s):
+    """
+    The set of tokens that fuzz.token_sort_ratio sees in s
+    """
+    return frozenset(fuzz_utils.full_process(s, force_ascii=True).split())
+
+
+def length_bound(la, lb):
+    """
+    The highest fuzz.token_sort_ratio possible between sorted token strings
+    of lengths la and lb, which can share at most min(la, lb) characters
+    """
+    if la == lb: return 100
+    return fuzz_utils.intr(100 * (2.0 * min(la, lb) / (la + lb)))
+
+
+def shared_bound(shared, la, lb):
+    """
+    The highest fuzz.token_sort_ratio possible between sorted token strings
+    of lengths la and lb that have only shared characters in common
+    """
+    if la + lb == 0: return 100
+    return fuzz_utils.intr(100 * (2.0 * shared / (la + lb)))
+
+
+class TokenIndex(object):
+    """
+    An inverted index from tokens to the keys that contain them.
+
+    Used to pick out the keys that are worth scoring against a query,
+    so that we don't have to run the fuzzy matcher on every key.
+    Keys are also grouped by the length of their sorted token string,
+    and their characters are counted, so that keys which share no tokens
+    with the query can still be found when they have a chance of scoring well.
+    """
+
+    def __init__(self, keys=(), min_overlap=0.25):
+        self.min_overlap = min_overlap  # fraction of query tokens a candidate must share
+        self.postings = defaultdict(set)
+        self.key_tokens = {}
+        self.lengths = {}
+        self.by_length = defaultdict(set)
+        self.sorted_keys = {}  # key -> sorted_tokens(key)
+        #character counts of each key, as a matrix if numpy is available
+        self.char_matrix = None if np is None else ArrayScorer()
+        self.char_counts = {}
+        self.positions = {}  # insertion order, so that ties break as in a full scan
+        self.next_position = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return len(self.key_tokens)
+
+    def add(self, key):
+        if key in self.key_tokens: return
+        tokens = tokenize(key)
+        self.key_tokens[key] = tokens
+        s = sorted_tokens(key)
+        self.lengths[key] = len(s)
+        self.by_length[len(s)].add(key)
+        self.sorted_keys[key] = s
+        if self.char_matrix is None:
+            self.char_counts[key] = Counter(s)
+        else:
+            self.char_matrix.add(key)
+        self.positions[key] = self.next_position
+        self.next_position += 1
+        for token in tokens:
+            self.postings[token].add(key)
+
+    def remove(self, key):
+        tokens = self.key_tokens.pop(key, None)
+        if tokens is None: return
+        del self.positions[key]
+        del self.sorted_keys[key]
+        if self.char_matrix is None:
+            del self.char_counts[key]
+        else:
+            self.char_matrix.remove(key)
+        length = self.lengths.pop(key)
+        self.by_length[length].discard(key)
+        if not self.by_length[length]: del self.by_length[length]
+        for token in tokens:
+            keys = self.postings[token]
+            keys.discard(key)
+            if not keys: del self.postings[token]
+
+    def candidates(self, query):
+        """
+        Return the keys that share enough tokens with query,
+        in the order they were added
+        """
+        tokens = tokenize(query)
+        overlaps = Counter()
+        for token in tokens:
+            overlaps.update(self.postings.get(token, ()))
+        needed = max(1, ceil(self.min_overlap * len(tokens)))
+        result = [k for k, overlap in overlaps.items() if overlap >= needed]
+        result.sort(key=self.positions.__getitem__)
+        return result
+
+    def best_matches(self, query, n=5):
+        """
+        The n keys that match query best, in the order best_matches
+        would give for every key.
+
+        The candidates are scored first, since they are likely to score
+        well, and then the other keys, each in order of an upper bound
+        on their score from their length and the characters they share
+        with query, until no remaining key can reach the results.
+        """
+        s = sorted_tokens(query)
+        query_counts = Counter(s)
+        scores = {}
+        top = []  # the n best scores so far, lowest first
+
+        def bounds(keys):
+            if self.char_matrix is not None:
+                return self.char_matrix.bounds(query, keys).tolist()
+            return [shared_bound(sum(min(count, query_counts[c])
+                                     for c, count in self.char_counts[k].items()),
+                                 len(s), self.lengths[k]) for k in keys]
+
+        def score_in_order(keys):
+            for b, _, k in sorted(zip([-b for b in bounds(keys)],
+                                      map(self.positions.__getitem__, keys),
+                                      keys)):
+                if len(top) == n and -b < top[0]: break
+                #the same as match(query, k), from the sorted strings
+                scores[k] = fuzz.ratio(s, self.sorted_keys[k])
+                if len(top) < n:
+                    heapq.heappush(top, scores[k])
+                elif scores[k] > top[0]:
+                    heapq.heapreplace(top, scores[k])
+
+        candidates = self.candidates(query)
+        score_in_order(candidates)
+        candidates = set(candidates)
+        others = []
+        for lb, keys in self.by_length.items():
+            if len(top) < n or length_bound(len(s), lb) >= top[0]:
+                others.extend(k for k in keys if k not in candidates)
+        score_in_order(others)
+        return heapq.nsmallest(
+            n, scores, key=lambda k: (-scores[k], self.positions[k]))
+
+
+def best_dict_values(query, d, deduplicate=True, n=5, filter=lambda x: True,
+                     index=None, scorer=None):
+    """
+    If index is given, it must hold the keys of d,
+    and it ranks them without scoring the keys that can't make the results.
+    Otherwise, if scorer is given, use it to rank the keys
+    instead of best_matches.
+    """
+    if index is not None:
+        keys = index.best_matches(query, n=3 * n)
+    elif scorer is not None:
+        keys = scorer.best_matches(query, d.keys(), n=3 * n)
+    else:
+        keys = best_matches(query, d.keys(), n=3 * n)
     result = []
     for k in keys:
         v = d[k]
@@ -35,39 +323,132 @@ def best_dict_values(query, d, deduplicate=True, n=5, filter=lambda x: True):
 
 
 class Suggester(object):
-    def __init__(self, kind, num_suggestions=5, num_shortcuts=5):
-        self.db = sqlite3.connect("memoize.db")
+    """
+    Caches responses in memoize.db and suggests responses for new observations.
+
+    If write_behind is set, writes to the database are queued and committed
+    together, once batch_size writes are queued or flush_interval seconds
+    have passed since the last commit, and when the Suggester is closed.
+    The time is checked on every write and read, and by flush_if_stale,
+    which callers that poll should run while they wait.
+    A crash can then lose at most the one batch that hasn't been committed.
+
+    If lazy is set, nothing is read at startup.
+    Exact lookups go to the database, behind an LRU of lru_size observations,
+    and the corpus used for fuzzy matching is read the first time
+    suggestions are requested.
+    """
+
+    def __init__(self, kind, num_suggestions=5, num_shortcuts=5,
+                 scorer="fuzz", write_behind=False, batch_size=100,
+                 flush_interval=5.0, lazy=False, lru_size=10000,
+                 path="memoize.db"):
+        self.db = sqlite3.connect(path)
+        self.path = path
         self.kind = kind
         self.cursor = self.db.cursor()
-        self.cache = self.load_cache()
         self.num_suggestions = num_suggestions
         self.num_shortcuts = num_shortcuts
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_writes = []
+        self.last_flush = time.time()
+        self.scorer_name = scorer
+        self.recent = utils.LRUCache(lru_size)
+        self.cache = None
+        if not lazy:
+            self.load_cache()
 
-    def load_cache(self):
-        self.cursor.execute("SELECT * FROM responses WHERE kind = ?",
-                            (self.kind, ))
-        return {obs: resp for obs, resp, source, kind in self.cursor}
+    def load_cache(self, chunk_size=1000):
+        """
+        Read every response of this kind into self.cache,
+        and build the index and scorer used for fuzzy matching.
+        """
+        self.flush()
+        self.cache = {}
+        self.index = TokenIndex()
+        self.scorer = scorers[self.scorer_name]()
+        rows = self.db.execute(
+            "SELECT input, output FROM responses WHERE kind = ?",
+            (self.kind, ))
+        while True:
+            chunk = rows.fetchmany(chunk_size)
+            if not chunk: break
+            for obs, resp in chunk:
+                self.cache[obs] = resp
+                self.index.add(obs)
+                self.scorer.add(obs)
+        self.recent.clear()
 
     def delete_cached_response(self, obs):
-        if obs in self.cache: del self.cache[obs]
-        self.cursor.execute(
-            "DELETE FROM responses WHERE input = ? AND kind = ?",
-            (obs, self.kind))
-        self.db.commit()
+        if self.cache is None:
+            self.recent[obs] = None
+        else:
+            if obs in self.cache: del self.cache[obs]
+            self.index.remove(obs)
+            self.scorer.remove(obs)
+        self.write("DELETE FROM responses WHERE input = ? AND kind = ?",
+                   (obs, self.kind))
 
     def get_cached_response(self, obs):
-        if obs in self.cache:
-            return self.cache[obs]
-        else:
-            return None
+        self.flush_if_stale()
+        if self.cache is not None:
+            return self.cache.get(obs)
+        response = self.recent.get(obs, utils.missing)
+        if response is utils.missing:
+            self.flush()
+            self.cursor.execute(
+                "SELECT output FROM responses WHERE kind = ? AND input = ?",
+                (self.kind, obs))
+            row = self.cursor.fetchone()
+            response = None if row is None else row[0]
+            self.recent[obs] = response
+        return response
 
     def set_cached_response(self, obs, response, src):
-        self.cache[obs] = response
-        self.cursor.execute("INSERT INTO responses VALUES (?, ?, ?, ?)",
-                            (obs, response, src, self.kind))
-        self.db.commit()
+        if self.cache is None:
+            self.recent[obs] = response
+        else:
+            self.cache[obs] = response
+            self.index.add(obs)
+            self.scorer.add(obs)
+        self.write("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                   (obs, response, src, self.kind))
+
+    def write(self, sql, params):
+        if not self.write_behind:
+            self.cursor.execute(sql, params)
+            self.db.commit()
+            return
+        self.pending_writes.append((sql, params))
+        if len(self.pending_writes) >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_if_stale()
+
+    def flush_if_stale(self):
+        """
+        Flush any queued writes if flush_interval seconds have passed
+        since the last commit
+        """
+        if (self.pending_writes and
+                time.time() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Commit all queued writes in a single transaction
+        """
+        if self.pending_writes:
+            with self.db:
+                for sql, params in self.pending_writes:
+                    self.cursor.execute(sql, params)
+            self.pending_writes = []
+        self.last_flush = time.time()
 
     def close(self):
+        self.flush()
         self.db.close()
 
     def make_suggestions_and_shortcuts(self,
@@ -79,6 +460,9 @@ class Suggester(object):
             num_suggestions = self.num_suggestions
         if num_shortcuts is None:
             num_shortcuts = self.num_shortcuts
+        self.flush_if_stale()
+        if self.cache is None:
+            self.load_cache()
         cache = self.cache
         shortcuts = []
 
@@ -113,7 +497,9 @@ class Suggester(object):
         suggestions = best_dict_values(obs,
                                        cache,
                                        filter=useful_suggestion,
-                                       n=num_suggestions)
+                                       n=num_suggestions,
+                                       index=self.index,
+                                       scorer=self.scorer)
         for h in suggestions:
             c = commands.parse_command(h)
             m = commands.parse_message(h)
@@ -127,6 +513,65 @@ class Suggester(object):
         return suggestions, shortcuts
 
 
+shared_suggesters = {}  # (database path, kind) -> [Suggester, number of users]
+
+
+class SharedSuggester(object):
+    """
+    A handle on the process-wide Suggester for a database and kind.
+
+    Every context in the process that opens the same database and kind
+    shares one cache and one connection, so a response written through
+    one handle is immediately visible through the others.
+    Each handle keeps its own number of suggestions and shortcuts.
+    """
+
+    def __init__(self, kind, num_suggestions=5, num_shortcuts=5,
+                 path="memoize.db", **kwargs):
+        """
+        kwargs are passed on to Suggester if this is the first handle
+        """
+        self.key = (os.path.abspath(path), kind)
+        if self.key not in shared_suggesters:
+            shared_suggesters[self.key] = [
+                Suggester(kind, path=path, **kwargs), 0]
+        shared_suggesters[self.key][1] += 1
+        self.suggester = shared_suggesters[self.key][0]
+        self.num_suggestions = num_suggestions
+        self.num_shortcuts = num_shortcuts
+
+    def get_cached_response(self, obs):
+        return self.suggester.get_cached_response(obs)
+
+    def set_cached_response(self, obs, response, src):
+        self.suggester.set_cached_response(obs, response, src)
+
+    def delete_cached_response(self, obs):
+        self.suggester.delete_cached_response(obs)
+
+    def flush_if_stale(self):
+        self.suggester.flush_if_stale()
+
+    def make_suggestions_and_shortcuts(self, env, obs):
+        return self.suggester.make_suggestions_and_shortcuts(
+            env,
+            obs,
+            num_suggestions=self.num_suggestions,
+            num_shortcuts=self.num_shortcuts)
+
+    def close(self):
+        """
+        Release this handle, closing the Suggester when no handles remain
+        """
+        if self.suggester is None: return
+        entry = shared_suggesters[self.key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del shared_suggesters[self.key]
+            self.suggester.close()
+        self.suggester = None
+
+
 def get_database_size():
     with closing(sqlite3.connect("memoize.db")) as conn:
         c = conn.cursor()
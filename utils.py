@@ -1,3 +1,8 @@
+from collections import OrderedDict
+
+missing = object()  # a default that can't be confused with a cached None
+
+
 def areinstances(xs, t):
     return isinstance(xs, tuple) and all(isinstance(x, t) for x in xs)
 
@@ -68,11 +73,60 @@ def matched_paren(s, k):
             return None
 
 
+def make_copier(cls, arg_names):
+    """
+    Generate a function that copies an instance of cls,
+    replacing the fields passed as keyword arguments.
+
+    If cls.copy_directly, the fields are set without calling __init__,
+    the slots named in cls.copy_resets are set to None,
+    and valid_copy is only checked if some field was replaced.
+    """
+    params = ", ".join("{}=missing".format(k) for k in arg_names)
+    lines = ["def copy(self, *, {}):".format(params)]
+    if cls.copy_directly:
+        lines += ["    new = new_instance(cls)", "    replaced = False"]
+        for k in arg_names:
+            lines += ["    if {0} is missing: new.{0} = self.{0}".format(k),
+                      "    else: new.{0} = {0}; replaced = True".format(k)]
+        lines += ["    new.{} = None".format(k) for k in cls.copy_resets]
+        if cls.valid_copy is not Copyable.valid_copy:
+            lines.append("    if replaced: assert new.valid_copy()")
+        lines.append("    return new")
+    else:
+        lines.append("    return cls({})".format(", ".join(
+            "{0}=self.{0} if {0} is missing else {0}".format(k)
+            for k in arg_names)))
+    namespace = {"cls": cls, "missing": missing, "new_instance": object.__new__}
+    exec("\n".join(lines), namespace)
+    return namespace["copy"]
+
+
 class Copyable(object):
+    """
+    An object whose fields are listed in arg_names,
+    and which can be copied with some of those fields replaced.
+
+    The first copy of each class generates a copy function specialized
+    to that class, which replaces the generic copy method.
+    """
+    __slots__ = ()
+    copy_directly = False  # set fields directly rather than calling __init__
+    copy_resets = ()  # cached values that a direct copy must not inherit
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        #so that no class inherits a copier generated for its parent
+        if "copy" not in cls.__dict__:
+            cls.copy = Copyable.copy
+
     def copy(self, **kwargs):
-        for k in self.arg_names:
-            if k not in kwargs: kwargs[k] = self.__dict__[k]
-        return self.__class__(**kwargs)
+        cls = self.__class__
+        cls.copy = make_copier(cls, self.arg_names)
+        return cls.copy(self, **kwargs)
+
+    def valid_copy(self):
+        return True
 
     @property
     def arg_names(self):
@@ -85,3 +139,152 @@ def is_power_of_ten(x):
         return False
     else:
         return is_power_of_ten(x // 10)
+
+
+class LRUCache(object):
+    """
+    A mapping that holds at most maxsize entries,
+    evicting the least recently used entry when it is full.
+
+    Keeps count of hits, misses and evictions.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self.evict()
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"size": len(self),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate}
+
+
+class PersistentVector(object):
+    """
+    An immutable sequence that shares structure with the vectors it was made from.
+
+    Items are stored in a trie with 32 children per node,
+    so appending or replacing an item copies a few small nodes
+    rather than the whole sequence.
+    """
+
+    bits = 5
+    width = 1 << bits
+
+    def __init__(self, items=()):
+        self.root = ()
+        self.depth = 0  # the number of levels above the leaves
+        self.length = 0
+        for x in items:
+            self.root, self.depth, self.length = self.appended(x)
+
+    @classmethod
+    def make(cls, root, depth, length):
+        result = cls.__new__(cls)
+        result.root = root
+        result.depth = depth
+        result.length = length
+        return result
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0: i += self.length
+        if i < 0 or i >= self.length:
+            raise IndexError("vector index out of range")
+        node = self.root
+        for level in range(self.depth, -1, -1):
+            node = node[(i >> (level * self.bits)) & (self.width - 1)]
+        return node
+
+    def __iter__(self):
+        def leaves(node, level):
+            if level == 0:
+                yield from node
+            else:
+                for child in node:
+                    yield from leaves(child, level - 1)
+
+        return leaves(self.root, self.depth)
+
+    def __add__(self, xs):
+        result = self
+        for x in xs:
+            result = result.append(x)
+        return result
+
+    def __repr__(self):
+        return "PersistentVector({})".format(list(self))
+
+    def assoc(self, node, level, i, x):
+        k = (i >> (level * self.bits)) & (self.width - 1)
+        if level == 0:
+            new_child = x
+        else:
+            child = node[k] if k < len(node) else ()
+            new_child = self.assoc(child, level - 1, i, x)
+        return node[:k] + (new_child, ) + node[k + 1:]
+
+    def appended(self, x):
+        root, depth = self.root, self.depth
+        if self.length == self.width**(depth + 1):
+            root, depth = (root, ), depth + 1
+        return self.assoc(root, depth, self.length, x), depth, self.length + 1
+
+    def append(self, x):
+        return self.make(*self.appended(x))
+
+    def set(self, i, x):
+        if i < 0: i += self.length
+        if i < 0 or i >= self.length:
+            raise IndexError("vector index out of range")
+        return self.make(self.assoc(self.root, self.depth, i, x), self.depth,
+                         self.length)
@@ -1,20 +1,45 @@
-from utils import clear_screen
+from utils import clear_screen, LRUCache, missing
 import time
-from random import random, randint
+import heapq
+import weakref
+from array import array
+from random import random, randint, Random
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#the default dimensions, for worlds and cells that don't have their own
 width = height = 11
 
 
 class X(object):
-    def __init__(self, x, y):
+    """
+    A cell, or an offset between cells
+
+    bounds is the (height, width) of the world the cell is in, if known;
+    it is carried along by arithmetic and used by is_valid.
+    """
+
+    __slots__ = ("x", "y", "bounds")
+
+    def __init__(self, x, y, bounds=None):
         self.x = x
         self.y = y
+        self.bounds = bounds
 
     def __add__(self, other):
-        return X(self.x + other.x, self.y + other.y)
+        return X(self.x + other.x, self.y + other.y, self.bounds)
 
     def __sub__(self, other):
-        return X(self.x - other.x, self.y - other.y)
+        return X(self.x - other.x, self.y - other.y, self.bounds)
+
+    def __eq__(self, other):
+        return isinstance(other, X) and self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
 
     def in_direction(self, direction):
         dx, dy = directions[direction]
@@ -24,8 +49,9 @@ class X(object):
         result = self + directions[direction]
         return result, result.is_valid()
 
-    def is_valid(self):
-        return self.x >= 0 and self.y >= 0 and self.x < height and self.y < width
+    def is_valid(self, bounds=None):
+        num_rows, num_cols = bounds or self.bounds or (height, width)
+        return 0 <= self.x < num_rows and 0 <= self.y < num_cols
 
     def __iter__(self):
         yield self.x
@@ -43,7 +69,7 @@ def update_tuple(t, i, f):
     return t[:i] + (f(t[i]), ) + t[i + 1:]
 
 
-def empty_grid():
+def empty_grid(width=width, height=height):
     return (((), ) * width, ) * height
 
 
@@ -63,13 +89,13 @@ def render(xs):
         return " and ".join(articulate(x) for x in xs)
 
 
-def default_world():
-    grid = empty_grid()
+def default_world(width=width, height=height):
+    grid = empty_grid(width, height)
 
     def add_random(grid, item):
         while True:
             x, y = randint(0, height - 1), randint(0, width - 1)
-            loc = X(x, y)
+            loc = X(x, y, (height, width))
             contents = access(grid, loc)
             if "block" not in contents and "agent" not in contents and "wall" not in contents and not "goal" in contents:
                 grid = add(grid, loc, item)
@@ -121,17 +147,54 @@ def render_small(xs):
     return "."
 
 
-def world_repr(world):
+def world_repr(world, top=0, left=0, rows=None, cols=None):
+    """
+    Render the window of rows x cols cells whose corner is (top, left),
+    by default the whole grid
+    """
+    if isinstance(world, ArrayWorld):
+        return world.world_repr(top, left, rows, cols)
+    grid, _, _ = world
+    bottom = len(grid) if rows is None else top + rows
+    right = None if cols is None else left + cols
+    return "\n".join("".join(render_small(x) for x in r[left:right])
+                     for r in grid[top:bottom])
+
+
+def dimensions(world):
+    if isinstance(world, ArrayWorld):
+        return world.height, world.width
     grid, _, _ = world
-    return "\n".join("".join(render_small(x) for x in r) for r in grid)
+    return len(grid), len(grid[0])
 
 
-def print_world(world, t=None):
+def viewport(world, rows, cols, center=None):
+    """
+    The corner of the rows x cols window centered on center,
+    by default the agent, shifted to lie inside the grid where possible
+    """
+    center = center or agent_cell(world)
+    num_rows, num_cols = dimensions(world)
+    top = max(0, min(center.x - rows // 2, num_rows - rows))
+    left = max(0, min(center.y - cols // 2, num_cols - cols))
+    return top, left
+
+
+def print_world(world, t=None, rows=None, cols=None):
+    """
+    Print the world, or the rows x cols window around the agent
+    """
     if t is None:
         clear_screen()
     else:
         t.clear()
-    lines = world_repr(world)
+    if rows is None and cols is None:
+        lines = world_repr(world)
+    else:
+        num_rows, num_cols = dimensions(world)
+        rows, cols = rows or num_rows, cols or num_cols
+        top, left = viewport(world, rows, cols)
+        lines = world_repr(world, top, left, rows, cols)
     for line in lines.split("\n"):
         if t is None:
             print(line)
@@ -184,7 +247,7 @@ for k in list(directions.keys()):
 
 
 def access(grid, cell):
-    if cell.is_valid():
+    if in_bounds(grid, cell):
         return grid[cell.x][cell.y]
     else:
         return None
@@ -211,6 +274,8 @@ def push(grid, cell, direction):
 
 
 def move_person(world, direction):
+    if isinstance(world, ArrayWorld):
+        return world.move_person(direction)
     if isinstance(direction, str):
         direction = directions[direction]
     grid, agent_xy, previous = world
@@ -226,15 +291,843 @@ def move_person(world, direction):
 
 
 def look(world, cell):
+    if isinstance(world, ArrayWorld):
+        return world.look(cell)
     grid, agent_xy, previous = world
     return render(access(grid, cell))
 
 
-def display_history(world, fps=5):
+def agent_cell(world):
+    if isinstance(world, ArrayWorld):
+        return world.agent
+    grid, agent_xy, previous = world
+    return agent_xy
+
+
+def previous_world(world):
+    if isinstance(world, ArrayWorld):
+        return world.previous
+    return world[2]
+
+
+def trajectory(world):
+    if isinstance(world, ArrayWorld):
+        return list(world.trajectory())
     history = []
     while world is not None:
         history.append(world)
         world = world[2]
-    for world in reversed(history):
-        print_world(world)
+    return history[::-1]
+
+
+def display_history(world, fps=5, rows=None, cols=None):
+    for world in trajectory(world):
+        print_world(world, rows=rows, cols=cols)
         time.sleep(1 / fps)
+
+
+AGENT, GOAL, BLOCK, WALL = 1, 2, 4, 8
+item_flags = {"goal": GOAL, "agent": AGENT, "block": BLOCK, "wall": WALL}
+#items sharing a cell are listed in this order, as in the tuple engine
+item_order = ["goal", "agent", "block", "wall"]
+flag_items = [tuple(x for x in item_order if flags & item_flags[x])
+              for flags in range(16)]
+flag_chars = [render_small(xs) for xs in flag_items]
+flag_descriptions = [render(xs) for xs in flag_items]
+
+
+class CellArray(object):
+    """
+    An immutable array of cell flags, one byte per cell.
+
+    The bytes are split into leaves of 64 cells, held in a trie with 32
+    children per node, so changing a cell copies a leaf and the nodes
+    above it and shares everything else with the original array.
+    """
+
+    __slots__ = ("root", "depth", "size")
+    leaf_bits = 6
+    branch_bits = 5
+
+    def __init__(self, cells):
+        cells = bytes(cells)
+        leaf_size = 1 << self.leaf_bits
+        branching = 1 << self.branch_bits
+        nodes = [cells[i:i + leaf_size]
+                 for i in range(0, max(len(cells), 1), leaf_size)]
+        depth = 0
+        while len(nodes) > 1:
+            nodes = [tuple(nodes[i:i + branching])
+                     for i in range(0, len(nodes), branching)]
+            depth += 1
+        self.root = nodes[0]
+        self.depth = depth
+        self.size = len(cells)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        node = self.root
+        shift = self.leaf_bits + self.branch_bits * self.depth
+        for _ in range(self.depth):
+            shift -= self.branch_bits
+            node = node[(i >> shift) & 31]
+        return node[i & 63]
+
+    def update(self, changes):
+        """
+        Return a copy with value stored in cell i, for each (i, value) in changes
+        """
+        leaves = {}
+        for i, value in changes:
+            leaf = leaves.get(i >> 6)
+            if leaf is None:
+                leaf = leaves[i >> 6] = bytearray(self.leaf(i >> 6))
+            leaf[i & 63] = value
+        root = self.root
+        for leaf_index, leaf in leaves.items():
+            node = bytes(leaf)
+            if self.depth == 1:
+                root = root[:leaf_index] + (node, ) + root[leaf_index + 1:]
+                continue
+            path = []
+            parent = root
+            for level in range(self.depth - 1, -1, -1):
+                k = (leaf_index >> (self.branch_bits * level)) & 31
+                path.append((parent, k))
+                parent = parent[k]
+            for parent, k in reversed(path):
+                node = parent[:k] + (node, ) + parent[k + 1:]
+            root = node
+        result = CellArray.__new__(CellArray)
+        result.root = root
+        result.depth = self.depth
+        result.size = self.size
+        return result
+
+    def leaf(self, leaf_index):
+        node = self.root
+        for level in range(self.depth - 1, -1, -1):
+            node = node[(leaf_index >> (self.branch_bits * level)) & 31]
+        return node
+
+    def slice(self, start, stop):
+        """
+        The bytes of cells start to stop, reading only the leaves they are in
+        """
+        parts = []
+        while start < stop:
+            offset = start & 63
+            leaf = self.leaf(start >> self.leaf_bits)
+            part = leaf[offset:offset + stop - start]
+            parts.append(part)
+            start += len(part)
+        return b"".join(parts)
+
+    def leaves(self):
+        def walk(node, level):
+            if level == 0:
+                yield node
+            else:
+                for child in node:
+                    yield from walk(child, level - 1)
+
+        return walk(self.root, self.depth)
+
+    def to_bytes(self):
+        return b"".join(self.leaves())
+
+
+class History(object):
+    """
+    The states a world passed through, stored as the cells changed by
+    each move, plus a full copy of the cells every keyframe_interval moves.
+
+    Each node describes one past state: the agent's cell, the changes
+    (index, flags before, flags after) made by the move out of that state,
+    and a keyframe if its index is a multiple of keyframe_interval.
+    """
+
+    __slots__ = ("parent", "index", "agent", "changes", "keyframe")
+    keyframe_interval = 32
+
+    def __init__(self, world, changes):
+        self.parent = world.history
+        self.index = 0 if self.parent is None else self.parent.index + 1
+        self.agent = world.agent
+        self.changes = changes
+        self.keyframe = (world.cells if self.index %
+                         self.keyframe_interval == 0 else None)
+
+    def __len__(self):
+        return self.index + 1
+
+    def node(self, index):
+        node = self
+        while node.index > index:
+            node = node.parent
+        return node
+
+    def cells(self):
+        """
+        Rebuild the cells of this state from the last keyframe before it
+        """
+        nodes = []
+        node = self
+        while node.keyframe is None:
+            node = node.parent
+            nodes.append(node)
+        cells = node.keyframe
+        if nodes:
+            updates = {}
+            for node in reversed(nodes):
+                for i, _, after in node.changes:
+                    updates[i] = after
+            cells = cells.update(list(updates.items()))
+        return cells
+
+
+def zobrist_key(i, flags):
+    """
+    The key that cell i holding flags contributes to a world's hash
+    """
+    return hash((i, flags)) if flags else 0
+
+
+def zobrist_hash(cells):
+    h = 0
+    for leaf_start, leaf in zip(range(0, len(cells), 64), cells.leaves()):
+        if any(leaf):
+            for offset, flags in enumerate(leaf):
+                if flags:
+                    h ^= hash((leaf_start + offset, flags))
+    return h
+
+
+class ArrayWorld(object):
+    """
+    A world whose cells are bit flags in a CellArray.
+
+    move_person, look, access and world_repr give the same results
+    as they do for the equivalent (grid, agent, previous) tuple,
+    but a move only touches the cells it changes.
+
+    zobrist is the XOR of zobrist_key over the cells,
+    kept up to date by each move from the cells it changes.
+    """
+
+    __slots__ = ("cells", "width", "height", "agent", "history", "zobrist",
+                 "__weakref__")
+
+    def __init__(self, cells, width, height, agent, history=None,
+                 zobrist=None):
+        self.cells = cells if isinstance(cells, CellArray) else CellArray(cells)
+        self.width = width
+        self.height = height
+        self.agent = agent
+        self.history = history
+        self.zobrist = zobrist_hash(self.cells) if zobrist is None else zobrist
+
+    @property
+    def previous(self):
+        return self.past(len(self.history) - 1) if self.history else None
+
+    def past(self, index):
+        """
+        Rebuild the state after the first index moves
+        """
+        if index == len(self.history or ()):
+            return self
+        node = self.history.node(index)
+        return ArrayWorld(node.cells(), self.width, self.height, node.agent,
+                          node.parent)
+
+    def trajectory(self):
+        """
+        Every state from the first to this one
+        """
+        nodes = []
+        node = self.history
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        cells = None
+        for node in reversed(nodes):
+            if node.keyframe is not None:
+                cells = node.keyframe
+            else:
+                cells = cells.update(
+                    [(i, after) for i, _, after in node.parent.changes])
+            yield ArrayWorld(cells, self.width, self.height, node.agent,
+                             node.parent)
+        yield self
+
+    def advance(self, changes, agent):
+        """
+        The world after changes, a tuple of (index, flags before, flags after),
+        with the agent in the given cell and this world recorded in its history
+        """
+        zobrist = self.zobrist
+        for i, before, after in changes:
+            #zobrist_key, inlined since every move runs this
+            if before: zobrist ^= hash((i, before))
+            if after: zobrist ^= hash((i, after))
+        return ArrayWorld(
+            self.cells.update([(i, after) for i, _, after in changes]),
+            self.width, self.height, agent, History(self, changes), zobrist)
+
+    @classmethod
+    def from_world(cls, world):
+        """
+        Convert a (grid, agent, previous) world, along with its history
+        """
+        history = []
+        while world is not None:
+            history.append(world)
+            world = world[2]
+        result = None
+        for grid, agent, _ in reversed(history):
+            cells = bytearray()
+            for row in grid:
+                for xs in row:
+                    flags = 0
+                    for x in xs:
+                        flags |= item_flags[x]
+                    cells.append(flags)
+            agent = X(agent.x, agent.y, (len(grid), len(grid[0])))
+            if result is None:
+                result = cls(cells, len(grid[0]), len(grid), agent)
+            else:
+                old = result.cells.to_bytes()
+                result = result.advance(
+                    tuple((i, old[i], flags) for i, flags in enumerate(cells)
+                          if flags != old[i]), agent)
+        return result
+
+    def to_world(self):
+        """
+        Convert to a (grid, agent, previous) world, along with its history
+        """
+        result = None
+        for world in self.trajectory():
+            cells = world.cells.to_bytes()
+            grid = tuple(
+                tuple(flag_items[flags]
+                      for flags in cells[i:i + world.width])
+                for i in range(0, len(cells), world.width))
+            result = (grid, world.agent, result)
+        return result
+
+    def in_bounds(self, cell):
+        return 0 <= cell.x < self.height and 0 <= cell.y < self.width
+
+    def flags(self, cell):
+        return self.cells[cell.x * self.width + cell.y]
+
+    def access(self, cell):
+        if self.in_bounds(cell):
+            return flag_items[self.flags(cell)]
+        else:
+            return None
+
+    def look(self, cell):
+        return render(self.access(cell))
+
+    def passable(self, cell, direction):
+        """
+        Whether cell can be entered from direction, pushing any blocks
+        """
+        return self.push_end(cell, direction) is not None
+
+    def push_end(self, cell, direction):
+        """
+        The index of the first cell without a block from cell onward,
+        or None if that cell can't be entered
+        """
+        x, y = cell.x, cell.y
+        while 0 <= x < self.height and 0 <= y < self.width:
+            i = x * self.width + y
+            flags = self.cells[i]
+            if flags & (AGENT | WALL):
+                return None
+            if not flags & BLOCK:
+                return i
+            x += direction.x
+            y += direction.y
+        return None
+
+    def move_person(self, direction):
+        if isinstance(direction, str):
+            direction = directions[direction]
+        #push_end, inlined since every move runs this
+        agent = self.agent
+        dx, dy = direction.x, direction.y
+        x, y = agent.x + dx, agent.y + dy
+        width, cells = self.width, self.cells
+        end_x, end_y = x, y
+        while True:
+            if not (0 <= end_x < self.height and 0 <= end_y < width):
+                return self, False
+            end = end_x * width + end_y
+            end_flags = cells[end]
+            if end_flags & (AGENT | WALL):
+                return self, False
+            if not end_flags & BLOCK:
+                break
+            end_x += dx
+            end_y += dy
+        source = agent.x * width + agent.y
+        i = x * width + y
+        before = cells[source]
+        if end == i:
+            changes = ((source, before, before & ~AGENT),
+                       (i, end_flags, end_flags | AGENT))
+        else:
+            target_flags = cells[i]
+            changes = ((source, before, before & ~AGENT),
+                       (i, target_flags, (target_flags & ~BLOCK) | AGENT),
+                       (end, end_flags, end_flags | BLOCK))
+        return self.advance(changes, X(x, y, agent.bounds)), True
+
+    def world_repr(self, top=0, left=0, rows=None, cols=None):
+        bottom = self.height if rows is None else min(top + rows, self.height)
+        right = self.width if cols is None else min(left + cols, self.width)
+        lines = []
+        for x in range(top, bottom):
+            row = self.cells.slice(x * self.width + left, x * self.width + right)
+            lines.append("".join(flag_chars[flags] for flags in row))
+        return "\n".join(lines)
+
+    def cell(self, x, y):
+        return X(x, y, (self.height, self.width))
+
+
+def generate_world(seed,
+                   width=width,
+                   height=height,
+                   block_density=0.1,
+                   wall_density=0.2):
+    """
+    The random world determined by seed
+
+    Like default_world, places an agent, a goal, and
+    int(density * width * height) blocks and walls in distinct cells,
+    but draws all of the cells at once from a private Random(seed).
+    """
+    rng = Random(seed)
+    size = width * height
+    num_blocks = int(block_density * size)
+    num_walls = int(wall_density * size)
+    placed = rng.sample(range(size), 2 + num_blocks + num_walls)
+    cells = bytearray(size)
+    cells[placed[0]] = AGENT
+    cells[placed[1]] = GOAL
+    for i in placed[2:2 + num_blocks]:
+        cells[i] = BLOCK
+    for i in placed[2 + num_blocks:]:
+        cells[i] = WALL
+    x, y = divmod(placed[0], width)
+    return ArrayWorld(cells, width, height, X(x, y, (height, width)))
+
+
+def world_stream(seed=None, **kwargs):
+    """
+    Yield (seed, world) pairs forever
+
+    Each world can be regenerated with generate_world(seed, **kwargs).
+    """
+    seeds = Random(seed)
+    while True:
+        world_seed = seeds.getrandbits(64)
+        yield world_seed, generate_world(world_seed, **kwargs)
+
+class WorldBatch(object):
+    """
+    N worlds of the same size, stepped together with numpy.
+
+    cells is an (N, height, width) array of cell flags
+    and agents an (N, 2) array of agent cells.
+    """
+
+    def __init__(self, cells, agents):
+        if np is None:
+            raise ImportError("WorldBatch requires numpy")
+        self.cells = cells
+        self.agents = agents
+
+    @classmethod
+    def from_worlds(cls, worlds):
+        worlds = [
+            w if isinstance(w, ArrayWorld) else ArrayWorld.from_world(
+                (w[0], w[1], None)) for w in worlds
+        ]
+        height, width = worlds[0].height, worlds[0].width
+        assert all(w.height == height and w.width == width for w in worlds)
+        cells = np.frombuffer(b"".join(w.cells.to_bytes() for w in worlds),
+                              dtype=np.uint8).reshape(len(worlds), height,
+                                                      width)
+        agents = np.array([(w.agent.x, w.agent.y) for w in worlds],
+                          dtype=np.intp).reshape(len(worlds), 2)
+        return cls(cells, agents)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def world(self, k):
+        height, width = self.cells.shape[1:]
+        x, y = map(int, self.agents[k])
+        return ArrayWorld(self.cells[k].tobytes(), width, height,
+                          X(x, y, (height, width)))
+
+    def flags(self, positions):
+        """
+        The flags of positions[k] in world k, and whether it is in bounds
+        """
+        height, width = self.cells.shape[1:]
+        x, y = positions[:, 0], positions[:, 1]
+        in_bounds = (x >= 0) & (x < height) & (y >= 0) & (y < width)
+        flags = np.zeros(len(self), dtype=np.uint8)
+        ks = np.nonzero(in_bounds)[0]
+        flags[ks] = self.cells[ks, x[ks], y[ks]]
+        return flags, in_bounds
+
+    def move_person(self, moves):
+        """
+        Move the agent of world k in direction moves[k], for every k
+
+        Returns the new batch and an array saying which agents moved.
+        """
+        steps = np.array([tuple(directions[d] if isinstance(d, str) else d)
+                          for d in moves],
+                         dtype=np.intp).reshape(len(self), 2)
+        #find the first cell without a block in front of each agent
+        searching = np.ones(len(self), dtype=bool)
+        moved = np.zeros(len(self), dtype=bool)
+        ends = self.agents.copy()
+        position = self.agents.copy()
+        for _ in range(max(self.cells.shape[1:])):
+            position += steps
+            flags, in_bounds = self.flags(position)
+            stopped = searching & (~in_bounds | (flags & (AGENT | WALL) != 0))
+            free = searching & ~stopped & (flags & BLOCK == 0)
+            ends[free] = position[free]
+            moved |= free
+            searching &= ~(stopped | free)
+            if not searching.any():
+                break
+        cells = self.cells.copy()
+        agents = self.agents.copy()
+        ks = np.nonzero(moved)[0]
+        source = self.agents[ks]
+        target = source + steps[ks]
+        end = ends[ks]
+        cells[ks, source[:, 0], source[:, 1]] &= 0xFF ^ AGENT
+        pushed = np.any(end != target, axis=1)
+        cells[ks[pushed], end[pushed, 0], end[pushed, 1]] |= BLOCK
+        cells[ks, target[:, 0], target[:, 1]] = (
+            cells[ks, target[:, 0], target[:, 1]] & (0xFF ^ BLOCK)) | AGENT
+        agents[ks] = target
+        return WorldBatch(cells, agents), moved
+
+    def look(self, positions):
+        """
+        Describe the contents of cell positions[k] in world k, for every k
+        """
+        positions = np.array([tuple(p) for p in positions],
+                             dtype=np.intp).reshape(len(self), 2)
+        flags, in_bounds = self.flags(positions)
+        return [
+            flag_descriptions[f] if ok else render(None)
+            for f, ok in zip(flags.tolist(), in_bounds.tolist())
+        ]
+
+
+def batch_move_person(worlds, moves):
+    """
+    Move the agent in each of worlds in the matching direction of moves
+
+    Returns a list of ArrayWorlds, with the inputs in their histories,
+    and a list of flags saying which agents moved.
+    """
+    worlds = [
+        w if isinstance(w, ArrayWorld) else ArrayWorld.from_world(w)
+        for w in worlds
+    ]
+    batch = WorldBatch.from_worlds(worlds)
+    result, moved = batch.move_person(moves)
+    before = batch.cells.reshape(len(batch), -1)
+    after = result.cells.reshape(len(batch), -1)
+    new_worlds = []
+    for k, world in enumerate(worlds):
+        if moved[k]:
+            changed = np.nonzero(before[k] != after[k])[0].tolist()
+            changes = tuple((i, int(before[k, i]), int(after[k, i]))
+                            for i in changed)
+            x, y = map(int, result.agents[k])
+            world = world.advance(changes, world.cell(x, y))
+        new_worlds.append(world)
+    return new_worlds, moved.tolist()
+
+
+def batch_look(worlds, cells):
+    return WorldBatch.from_worlds(worlds).look(cells)
+
+
+def as_array_world(world):
+    if isinstance(world, ArrayWorld):
+        return world
+    grid, agent, _ = world
+    return ArrayWorld.from_world((grid, agent, None))
+
+
+def state_key(world):
+    """
+    A hashable description of the cells and agent of world
+    """
+    if isinstance(world, ArrayWorld):
+        return world.cells.root, world.agent.x, world.agent.y
+    grid, agent, _ = world
+    return grid, agent.x, agent.y
+
+
+def world_hash(world):
+    """
+    A hashable key for the state of world: its Zobrist hash and size
+    for array worlds, and its contents for tuple worlds
+    """
+    if isinstance(world, ArrayWorld):
+        return world.zobrist, world.height, world.width
+    return state_key(world)
+
+
+class WorldTable(object):
+    """
+    Maps each array world to a canonical world in the same state,
+    so that identical states share one cell array.
+
+    A world keeps its own agent and history: it is only replaced by
+    the canonical world when their histories are the same,
+    and otherwise by a copy of itself holding the canonical cells.
+    Entries go away when nothing else refers to the canonical world.
+    """
+
+    def __init__(self):
+        self.worlds = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.worlds)
+
+    def intern(self, world):
+        if not isinstance(world, ArrayWorld):
+            return world
+        key = world_hash(world)
+        canonical = self.worlds.get(key)
+        if (canonical is not None and canonical.agent == world.agent
+                and canonical.cells.root == world.cells.root):
+            self.hits += 1
+            if canonical.history is world.history:
+                return canonical
+            return ArrayWorld(canonical.cells, world.width, world.height,
+                              world.agent, world.history, canonical.zobrist)
+        self.misses += 1
+        self.worlds[key] = world
+        return world
+
+
+world_table = WorldTable()
+
+
+def intern_world(world):
+    return world_table.intern(world)
+
+
+def rebase(world, parent):
+    """
+    The state of world, reached by one move from parent,
+    which is in the same state as the world that world moved from,
+    but with parent's history rather than that world's
+    """
+    if isinstance(world, ArrayWorld):
+        node = world.history
+        if node is None or (node.parent is parent.history
+                            and node.agent == parent.agent):
+            return world
+        return ArrayWorld(world.cells, world.width, world.height, world.agent,
+                          History(parent, node.changes), world.zobrist)
+    if world[2] is parent:
+        return world
+    return world[0], world[1], parent
+
+
+def layout_key(world):
+    """
+    A hashable description of the cells of world other than the agent,
+    which is all that the distances to the goal depend on
+    """
+    world = as_array_world(world)
+    i = world.agent.x * world.width + world.agent.y
+    cells = world.cells.update([(i, world.cells[i] & ~AGENT)])
+    return world.width, cells.to_bytes()
+
+
+move_names = ["north", "south", "west", "east"]
+goal_table = bytes(1 if flags & GOAL else 0 for flags in range(256))
+
+
+class Oracle(object):
+    """
+    Shortest paths from the agent to the goal in one world state
+
+    walk_distances[i] is the number of moves from cell i to the goal
+    walking around blocks, and wall_distances[i] the number if blocks
+    were not there, or -1 if there is no such path. Nothing can walk onto
+    a goal with a block on it, since the last move would push the block.
+    plan() searches the moves themselves with A*, so that the agent may
+    push blocks, using wall_distances as the heuristic. If the search expands more
+    than max_nodes states it gives up and falls back to walking.
+
+    The distance fields don't depend on where the agent is, so an oracle
+    can take them from another for the same layout.
+    """
+
+    max_nodes = 20000
+
+    def __init__(self, world, fields=None):
+        self.world = as_array_world(world)
+        self.width = self.world.width
+        self.height = self.world.height
+        self.cells = self.world.cells.to_bytes()
+        if fields is None:
+            goal = self.cells.translate(goal_table).find(1)
+            self.goal = None if goal < 0 else goal
+            self.walk_distances = self.distance_field(WALL | BLOCK)
+            self.wall_distances = self.distance_field(WALL)
+        else:
+            self.goal, self.walk_distances, self.wall_distances = fields
+        self.gave_up = False
+        self._plan = missing
+
+    @property
+    def fields(self):
+        return self.goal, self.walk_distances, self.wall_distances
+
+    def index(self, cell):
+        return cell.x * self.width + cell.y
+
+    def neighbors(self, i):
+        x, y = divmod(i, self.width)
+        if x > 0: yield "north", i - self.width
+        if x < self.height - 1: yield "south", i + self.width
+        if y > 0: yield "west", i - 1
+        if y < self.width - 1: yield "east", i + 1
+
+    def distance_field(self, obstacles):
+        """
+        Breadth first search outward from the goal
+        through cells without obstacles
+        """
+        distances = array("i", [-1]) * len(self.cells)
+        if self.goal is None or self.cells[self.goal] & obstacles:
+            return distances
+        distances[self.goal] = 0
+        frontier = [self.goal]
+        while frontier:
+            next_frontier = []
+            for i in frontier:
+                d = distances[i] + 1
+                for _, j in self.neighbors(i):
+                    if distances[j] < 0 and not self.cells[j] & obstacles:
+                        distances[j] = d
+                        next_frontier.append(j)
+            frontier = next_frontier
+        return distances
+
+    def walk(self, i):
+        """
+        Follow walk_distances downhill from cell i to the goal
+        """
+        path = []
+        while i != self.goal:
+            for name, j in self.neighbors(i):
+                if self.walk_distances[j] == self.walk_distances[i] - 1:
+                    path.append(name)
+                    i = j
+                    break
+        return path
+
+    def plan(self):
+        """
+        The directions of a shortest path from the agent to the goal,
+        or None if there is none
+        """
+        if self._plan is missing:
+            self._plan = self.search()
+        return self._plan
+
+    def search(self):
+        start = self.index(self.world.agent)
+        if self.goal is None or self.wall_distances[start] < 0:
+            return None
+        if self.walk_distances[start] == self.wall_distances[start]:
+            return self.walk(start)
+        #states are keyed by the cells that differ from the start
+        start_key = frozenset()
+        states = {start_key: (self.world, {}, 0)}
+        came_from = {start_key: None}
+        frontier = [(self.wall_distances[start], 0, 0, start_key)]
+        counter = 0
+        while frontier:
+            _, _, _, key = heapq.heappop(frontier)
+            world, changes, g = states[key]
+            if self.index(world.agent) == self.goal:
+                path = []
+                while came_from[key] is not None:
+                    key, name = came_from[key]
+                    path.append(name)
+                return path[::-1]
+            if len(states) > self.max_nodes:
+                self.gave_up = True
+                break
+            for name in move_names:
+                new_world, moved = world.move_person(name)
+                if not moved:
+                    continue
+                new_changes = dict(changes)
+                for i, _, after in new_world.history.changes:
+                    if after == self.cells[i]:
+                        new_changes.pop(i, None)
+                    else:
+                        new_changes[i] = after
+                new_key = frozenset(new_changes.items())
+                if new_key in states and states[new_key][2] <= g + 1:
+                    continue
+                states[new_key] = (new_world, new_changes, g + 1)
+                came_from[new_key] = (key, name)
+                h = self.wall_distances[self.index(new_world.agent)]
+                counter += 1
+                heapq.heappush(frontier, (g + 1 + h, -g - 1, counter, new_key))
+        if self.walk_distances[start] >= 0:
+            return self.walk(start)
+        return None
+
+
+oracle_cache = LRUCache(maxsize=1000)
+fields_cache = LRUCache(maxsize=100)
+
+
+def get_oracle(world):
+    """
+    The Oracle for world, shared by every world in the same state,
+    and sharing distance fields with every world in the same layout
+    """
+    key = state_key(world)
+    oracle = oracle_cache.get(key)
+    if oracle is None:
+        layout = layout_key(world)
+        oracle = Oracle(world, fields_cache.get(layout))
+        fields_cache[layout] = oracle.fields
+        oracle_cache[key] = oracle
+    return oracle